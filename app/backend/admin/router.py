@@ -0,0 +1,54 @@
+import hmac
+import asyncio
+
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from app.backend.logging_config import logger
+from app.backend.profiling import (
+    MAX_PROFILE_SECONDS, PROFILERS, PROFILING_TOKEN
+)
+
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+# Одновременно снимается только один профиль
+_profile_lock = asyncio.Lock()
+
+
+def check_token(token: str) -> None:
+    """Проверить токен доступа к профилированию."""
+    if not PROFILING_TOKEN or not hmac.compare_digest(
+            token.encode(), PROFILING_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+
+@router.get(
+    "/profile",
+    status_code=status.HTTP_200_OK,
+    summary="Снятие профиля CPU или памяти",
+    response_class=PlainTextResponse
+)
+async def capture_profile(
+    kind: str = Query("cpu", pattern="^(cpu|memory)$"),
+    seconds: float = Query(10, gt=0, le=MAX_PROFILE_SECONDS),
+    x_profiling_token: str = Header("")
+) -> PlainTextResponse:
+    """Снять профиль работающего процесса.
+
+    cpu - семплирующий профиль в формате collapsed stacks без
+    простаивающих потоков,
+    memory - выделения памяти по данным tracemalloc.
+    """
+    check_token(x_profiling_token)
+
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="Профиль уже снимается")
+
+    async with _profile_lock:
+        logger.info("Снятие профиля %s на %s с", kind, seconds)
+        # Профилировщик работает в отдельном потоке, event loop
+        # продолжает обслуживать запросы и попадает в профиль
+        result = await asyncio.to_thread(PROFILERS[kind], seconds)
+
+    return PlainTextResponse(result)
@@ -0,0 +1,177 @@
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+from app.backend.database.db import async_session
+from app.backend.images.rabbitmq import publisher
+from app.backend.images.repository import ImageRepository
+from app.backend.logging_config import logger
+
+# Допустимое ожидание задачи в очереди, секунды
+QUEUE_SLO_SECONDS = float(os.getenv("ADMISSION_QUEUE_SLO_SECONDS", "60"))
+# Период обновления глубины очереди и скорости обработки
+REFRESH_SECONDS = float(os.getenv("ADMISSION_REFRESH_SECONDS", "2"))
+# Окно, по которому оценивается скорость обработки
+RATE_WINDOW_SECONDS = int(os.getenv("ADMISSION_RATE_WINDOW_SECONDS", "60"))
+# Нижняя граница оценки скорости, изображений в секунду. Без нее после
+# простоя (ничего не завершено за окно) отклонялась бы любая загрузка
+MIN_COMPLETION_RATE = float(os.getenv("ADMISSION_MIN_RATE", "1"))
+# Лимит загрузок одного клиента: скорость и размер всплеска
+CLIENT_RATE = float(os.getenv("UPLOAD_RATE_PER_CLIENT", "5"))
+CLIENT_BURST = float(os.getenv("UPLOAD_BURST_PER_CLIENT", "20"))
+MAX_TRACKED_CLIENTS = 100_000
+
+
+class AdmissionRejectedError(Exception):
+    """Загрузка отклонена контролем нагрузки."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket для ограничения частоты запросов."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Взять токен; вернуть 0 или время до появления токена."""
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self) -> None:
+        """Вернуть взятый токен."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class AdmissionController:
+    """Контроль допуска загрузок по глубине очереди и лимитам клиентов.
+
+    Глубина очереди и скорость обработки обновляются фоновой задачей,
+    поэтому проверка запроса не делает сетевых вызовов.
+    """
+
+    def __init__(self) -> None:
+        self.queue_depth = 0
+        self.completion_rate = MIN_COMPLETION_RATE
+        self.refreshed_at: Optional[float] = None
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> None:
+        """Обновить глубину очереди и оценку скорости обработки."""
+        depth, _ = await publisher.get_queue_stats()
+
+        async with async_session() as session:
+            repository = ImageRepository(session)
+            finished = await repository.count_finished_since(
+                RATE_WINDOW_SECONDS
+            )
+
+        self.queue_depth = depth
+        self.completion_rate = max(
+            finished / RATE_WINDOW_SECONDS, MIN_COMPLETION_RATE
+        )
+        self.refreshed_at = time.monotonic()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.refresh(), timeout=REFRESH_SECONDS * 5
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Не удалось обновить состояние очереди: %s", str(e)
+                )
+            await asyncio.sleep(REFRESH_SECONDS)
+
+    def start(self) -> None:
+        """Запустить фоновое обновление."""
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить фоновое обновление."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def _bucket(self, client: str) -> TokenBucket:
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = TokenBucket(CLIENT_RATE, CLIENT_BURST)
+            self.buckets[client] = bucket
+            if len(self.buckets) > MAX_TRACKED_CLIENTS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client)
+        return bucket
+
+    def admit(self, client: str) -> None:
+        """Проверить, можно ли принять загрузку от клиента.
+
+        Бросает AdmissionRejectedError с кодом 429 при превышении лимита
+        клиента и 503, если прогноз ожидания в очереди больше SLO.
+        Токен клиента резервируется: если загрузка не будет принята,
+        его нужно вернуть через cancel.
+        """
+        # Если данные об очереди устарели, не отклоняем загрузки
+        stale = (
+            self.refreshed_at is None
+            or time.monotonic() - self.refreshed_at > REFRESH_SECONDS * 5
+        )
+        if not stale:
+            projected_wait = self.queue_depth / self.completion_rate
+            if projected_wait > QUEUE_SLO_SECONDS:
+                # Время, за которое очередь сократится до уровня SLO
+                excess = self.queue_depth - (
+                    self.completion_rate * QUEUE_SLO_SECONDS
+                )
+                raise AdmissionRejectedError(
+                    503,
+                    max(1, math.ceil(excess / self.completion_rate)),
+                    "Сервис перегружен, повторите позже"
+                )
+
+        wait = self._bucket(client).take()
+        if wait:
+            raise AdmissionRejectedError(
+                429, math.ceil(wait), "Слишком много загрузок"
+            )
+
+    def cancel(self, client: str) -> None:
+        """Вернуть токен клиента: загрузка отклонена или не удалась."""
+        bucket = self.buckets.get(client)
+        if bucket is not None:
+            bucket.refund()
+
+    def accept(self) -> None:
+        """Учесть поставленную в очередь задачу до следующего обновления."""
+        self.queue_depth += 1
+
+
+# Глобальный контроллер допуска загрузок
+admission = AdmissionController()
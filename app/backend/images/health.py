@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from app.backend.database.db import engine
+from app.backend.images.rabbitmq import publisher
+from app.backend.logging_config import logger
+
+# Период фоновой проверки зависимостей, секунды
+REFRESH_SECONDS = float(os.getenv("HEALTH_REFRESH_SECONDS", "5"))
+# Таймаут одной проверки, секунды
+TIMEOUT_SECONDS = float(os.getenv("HEALTH_TIMEOUT_SECONDS", "2"))
+# Учитывать ли брокер в readiness. По умолчанию нет: без брокера загрузки
+# сохраняются в NEW и отправляются reaper'ом, а чтение работает
+READY_REQUIRES_BROKER = os.getenv("HEALTH_READY_REQUIRES_BROKER") == "1"
+
+
+class HealthMonitor:
+    """Фоновая проверка PostgreSQL и RabbitMQ.
+
+    Пробы отдают последний сохраненный результат и не обращаются к
+    зависимостям, поэтому их задержка не зависит от задержки БД и
+    брокера. Используются общий пул подключений к БД и общее
+    подключение publisher'а к RabbitMQ.
+    """
+
+    def __init__(self) -> None:
+        self.state: Dict = {
+            "service": "ok",
+            "database": "unknown",
+            "rabbitmq": "unknown",
+            "queue_depth": None,
+            "consumers": None,
+            "checked_at": None
+        }
+        self.refreshed_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def _ping_database(self) -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def _check_database(self) -> str:
+        try:
+            # Таймаут покрывает и получение подключения из пула: при
+            # исчерпанном пуле или недоступной БД ждать можно долго
+            await asyncio.wait_for(
+                self._ping_database(), timeout=TIMEOUT_SECONDS
+            )
+            return "ok"
+        except Exception as e:
+            logger.error("Ошибка подключения к базе данных: %r", e)
+            return f"error: {e!r}"
+
+    async def _check_rabbitmq(self) -> str:
+        try:
+            depth, consumers = await asyncio.wait_for(
+                publisher.get_queue_stats(), timeout=TIMEOUT_SECONDS
+            )
+            self.state["queue_depth"] = depth
+            self.state["consumers"] = consumers
+            return "ok"
+        except Exception as e:
+            self.state["queue_depth"] = None
+            self.state["consumers"] = None
+            logger.error("Ошибка подключения к RabbitMQ: %r", e)
+            return f"error: {e!r}"
+
+    async def refresh(self) -> None:
+        """Проверить зависимости и сохранить результат."""
+        database, rabbitmq = await asyncio.gather(
+            self._check_database(), self._check_rabbitmq()
+        )
+        self.state["database"] = database
+        self.state["rabbitmq"] = rabbitmq
+        self.state["checked_at"] = datetime.now(timezone.utc).isoformat()
+        self.refreshed_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        """Результат устарел: фоновая проверка не успевает или упала."""
+        return (
+            self.refreshed_at is None
+            or time.monotonic() - self.refreshed_at > REFRESH_SECONDS * 3
+        )
+
+    def is_ready(self) -> bool:
+        """Готов ли сервис принимать запросы.
+
+        Состояние брокера учитывается только при
+        HEALTH_READY_REQUIRES_BROKER=1.
+        """
+        return (
+            not self.is_stale()
+            and self.state["database"] == "ok"
+            and (not READY_REQUIRES_BROKER or self.state["rabbitmq"] == "ok")
+        )
+
+    def snapshot(self) -> Dict:
+        """Последний результат проверки."""
+        return dict(self.state, stale=self.is_stale())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Не удалось проверить состояние сервиса: %s",
+                               str(e))
+            await asyncio.sleep(REFRESH_SECONDS)
+
+    def start(self) -> None:
+        """Запустить фоновую проверку."""
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить фоновую проверку."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+# Глобальный монитор состояния процесса API
+health_monitor = HealthMonitor()
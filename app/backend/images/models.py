@@ -1,6 +1,10 @@
-from sqlalchemy import String, Uuid, Enum, JSON
+from sqlalchemy import (
+    BigInteger, String, Text, Uuid, Enum, JSON, DateTime, Index, Integer,
+    SmallInteger, func, text
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from uuid import UUID, uuid4
+from datetime import datetime
 from typing import Dict, Optional
 import enum
 
@@ -18,6 +22,21 @@ class ImageStatus(str, enum.Enum):
 
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (
+        # Keyset-пагинация по времени создания: (created_at, id) даёт
+        # стабильный порядок даже при совпадении времени
+        Index("ix_images_created_at_id", "created_at", "id"),
+        Index("ix_images_status_created_at_id", "status", "created_at", "id"),
+        # Поиск зависших задач
+        Index("ix_images_status_updated_at", "status", "updated_at"),
+        # Оценка скорости обработки по недавно завершенным изображениям
+        Index("ix_images_finished_at", "finished_at"),
+        # Новые изображения, задача для которых не дошла до очереди
+        Index(
+            "ix_images_unenqueued_updated_at", "updated_at",
+            postgresql_where=text("status = 'NEW' AND enqueued_at IS NULL")
+        ),
+    )
 
     id: Mapped[UUID] = mapped_column(Uuid, primary_key=True, default=uuid4)
     status: Mapped[ImageStatus] = mapped_column(
@@ -26,3 +45,31 @@ class Image(Base):
     original_url: Mapped[str] = mapped_column(String, nullable=False)
     thumbnails: Mapped[Optional[Dict[str, str]]] = mapped_column(
         JSON, nullable=True)
+    # Метаданные из заголовка файла, прочитанные при загрузке
+    format: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    width: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    height: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    orientation: Mapped[Optional[int]] = mapped_column(
+        SmallInteger, nullable=True)
+    frames: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # dHash самого маленького thumbnail (64 бита, хранится со знаком)
+    phash: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    # Крошечное превью (WebP data URI) для мгновенной отрисовки
+    placeholder: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Время успешной отправки задачи в очередь
+    enqueued_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    # Время, когда worker завершил обработку (DONE или ERROR)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False
+    )
@@ -1,24 +1,59 @@
 import pika
 import json
 import os
-from typing import Callable, Any
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, Iterable, Optional, Tuple
+from app.backend.images.models import Image
 from app.backend.logging_config import logger
 
+# Наибольшее время отправки задачи из API, секунды. Тот же таймаут
+# ставится на сокет и блокировку подключения publisher'а, чтобы
+# зависшая отправка не держала его поток
+PUBLISH_TIMEOUT = float(os.getenv("RABBITMQ_PUBLISH_TIMEOUT_SECONDS", "2"))
+
+
+def build_task_message(image: Image) -> dict:
+    """Сформировать сообщение задачи на обработку изображения.
+
+    Метаданные заголовка передаются worker'у, чтобы он мог выбрать
+    масштаб декодирования без лишнего запроса в БД.
+    """
+    return {
+        "task_id": str(uuid.uuid4()),
+        "image_id": str(image.id),
+        "file_path": image.original_url,
+        "metadata": {
+            "format": image.format,
+            "width": image.width,
+            "height": image.height,
+            "orientation": image.orientation,
+            "frames": image.frames
+        }
+    }
+
 
 class RabbitMQClient:
-    def __init__(self):
+    def __init__(self, timeout: Optional[float] = None) -> None:
         self.rabbitmq_url = os.getenv("RABBITMQ_URL")
-        self.connection = None
-        self.channel = None
+        # Таймаут подключения, операций с сокетом и блокировки
+        # подключения брокером; None - значения pika по умолчанию
+        self.timeout = timeout
+        self.connection: Any = None
+        self.channel: Any = None
 
     def connect(self):
         """Подключиться к RabbitMQ."""
         logger.info("Попытка подключения к RabbitMQ")
 
         try:
-            self.connection = pika.BlockingConnection(
-                pika.URLParameters(self.rabbitmq_url)
-            )
+            parameters = pika.URLParameters(self.rabbitmq_url)
+            if self.timeout is not None:
+                parameters.socket_timeout = self.timeout
+                parameters.stack_timeout = self.timeout
+                parameters.blocked_connection_timeout = self.timeout
+            self.connection = pika.BlockingConnection(parameters)
             self.channel = self.connection.channel()
             # Объявляем очередь
             self.channel.queue_declare(queue='images', durable=True)
@@ -62,6 +97,46 @@ class RabbitMQClient:
             logger.error("Ошибка отправки сообщения в RabbitMQ: %s", str(e))
             raise
 
+    def _get_channel(self) -> Any:
+        """Вернуть канал, подключившись при необходимости."""
+        if not self.connection or self.connection.is_closed:
+            self.connect()
+        return self.channel
+
+    def get_queue_stats(self, queue_name: str = 'images') -> Tuple[int, int]:
+        """Получить число готовых сообщений и потребителей очереди."""
+        channel = self._get_channel()
+        result = channel.queue_declare(queue=queue_name, passive=True)
+        return result.method.message_count, result.method.consumer_count
+
+    def send_messages(
+            self,
+            messages: Iterable[dict],
+            queue_name: str = 'images'
+    ) -> int:
+        """Отправить пачку сообщений через одно подключение."""
+        try:
+            channel = self._get_channel()
+
+            count = 0
+            for message in messages:
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=queue_name,
+                    body=json.dumps(message),
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,
+                    )
+                )
+                count += 1
+
+            logger.info("Отправлено %s сообщений в очередь %s",
+                        count, queue_name)
+            return count
+        except Exception as e:
+            logger.error("Ошибка отправки сообщений в RabbitMQ: %s", str(e))
+            raise
+
     def consume_messages(
             self,
             callback: Callable[[dict], Any],
@@ -105,3 +180,56 @@ class RabbitMQClient:
         except Exception as e:
             logger.error("Ошибка потребления сообщений: %s", str(e))
             raise
+
+
+class AsyncRabbitMQPublisher:
+    """Долгоживущее подключение к RabbitMQ для приложения.
+
+    BlockingConnection не потокобезопасен, поэтому все вызовы идут через
+    один выделенный поток, а event loop не блокируется.
+    """
+
+    def __init__(self) -> None:
+        self.client = RabbitMQClient(timeout=PUBLISH_TIMEOUT)
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="rabbitmq"
+        )
+
+    def _call(self, method: Callable[..., Any], *args: Any) -> Any:
+        try:
+            return method(*args)
+        except Exception as e:
+            # Подключение могло оборваться незаметно: переподключаемся
+            # и повторяем вызов один раз
+            logger.warning("Повторное подключение к RabbitMQ: %s", str(e))
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+            self.client.connection = None
+            return method(*args)
+
+    async def _run(self, method: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._call, method, *args
+        )
+
+    async def send_message(self, message: dict) -> None:
+        """Отправить сообщение в очередь."""
+        await self._run(self.client.send_message, message)
+
+    async def get_queue_stats(self) -> Tuple[int, int]:
+        """Получить число готовых сообщений и потребителей очереди."""
+        stats: Tuple[int, int] = await self._run(self.client.get_queue_stats)
+        return stats
+
+    async def close(self) -> None:
+        """Закрыть подключение и остановить поток."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.client.disconnect)
+        self.executor.shutdown(wait=True)
+
+
+# Общий publisher процесса API
+publisher = AsyncRabbitMQPublisher()
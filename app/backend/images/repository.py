@@ -1,25 +1,47 @@
+from datetime import datetime, timedelta
 from uuid import UUID
 from sqlalchemy.future import select
-from sqlalchemy import update
+from sqlalchemy import (
+    Uuid, and_, any_, bindparam, func, or_, tuple_, update
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql import ColumnElement
 
 from app.backend.images.models import Image, ImageStatus
+from app.backend.images.sniffing import ImageHeader
+from app.backend.images.utils import to_signed64
 from app.backend.database.db import SessionDep
 from app.backend.logging_config import logger
+from app.backend.profiling import trace_span
 
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
 
 class ImageRepository:
     def __init__(self, db: SessionDep):
         self.db = db
 
-    async def create_image(self, original_url: str) -> Image:
+    async def create_image(
+            self,
+            original_url: str,
+            header: Optional[ImageHeader] = None,
+            image_id: Optional[UUID] = None
+    ) -> Image:
         """Создать новую запись изображения в БД."""
         logger.info("Создание записи изображения в БД: %s", original_url)
 
         image = Image(original_url=original_url, status=ImageStatus.NEW)
+        if image_id is not None:
+            image.id = image_id
+        if header is not None:
+            image.format = header.format
+            image.width = header.width
+            image.height = header.height
+            image.orientation = header.orientation
+            image.frames = header.frames
         self.db.add(image)
-        await self.db.commit()
+        with trace_span("db.commit"):
+            await self.db.commit()
         await self.db.refresh(image)
 
         logger.info("Изображение успешно создано в БД с ID: %s", image.id)
@@ -41,18 +63,156 @@ class ImageRepository:
 
         return image
 
+    async def stream_images(
+            self,
+            status: Optional[ImageStatus],
+            after: Optional[Tuple[datetime, UUID]],
+            limit: int
+    ) -> AsyncIterator[Image]:
+        """Потоково выбрать изображения в порядке создания.
+
+        Keyset-пагинация: строки после позиции (created_at, id) читаются
+        по индексу, поэтому время выборки не зависит от размера таблицы.
+        """
+        logger.info("Выборка изображений: статус %s, лимит %s",
+                    status, limit)
+
+        stmt = select(Image)
+        if status is not None:
+            stmt = stmt.where(Image.status == status)
+        if after is not None:
+            stmt = stmt.where(tuple_(Image.created_at, Image.id) > after)
+        stmt = (
+            stmt.order_by(Image.created_at, Image.id)
+            .limit(limit)
+            .execution_options(yield_per=100)
+        )
+
+        result = await self.db.stream_scalars(stmt)
+        async for image in result:
+            yield image
+
+    async def get_images_by_ids(self, image_ids: List[UUID]) -> List[Image]:
+        """Получить изображения по списку ID одним запросом.
+
+        Список передается одним параметром-массивом (id = ANY(:ids)),
+        поэтому текст запроса не зависит от числа ID и план кешируется.
+        """
+        stmt = select(Image).where(
+            Image.id == any_(bindparam("ids", image_ids, type_=ARRAY(Uuid)))
+        )
+        result = await self.db.execute(stmt)
+        return list(result.scalars().all())
+
+    async def lock_images_page(
+            self,
+            after: Optional[Tuple[datetime, UUID]],
+            limit: int
+    ) -> List[Image]:
+        """Выбрать и заблокировать страницу изображений по порядку создания.
+
+        Транзакция не фиксируется: блокировки держатся до commit
+        в вызывающем коде.
+        """
+        stmt = select(Image)
+        if after is not None:
+            stmt = stmt.where(tuple_(Image.created_at, Image.id) > after)
+        stmt = (
+            stmt.order_by(Image.created_at, Image.id)
+            .limit(limit)
+            .with_for_update()
+        )
+        result = await self.db.execute(stmt)
+        return list(result.scalars().all())
+
+    async def lock_images_by_ids(self, image_ids: List[UUID]) -> List[Image]:
+        """Выбрать и заблокировать изображения по списку ID.
+
+        Транзакция не фиксируется: блокировки держатся до commit
+        в вызывающем коде.
+        """
+        stmt = (
+            select(Image)
+            .where(Image.id.in_(image_ids))
+            .order_by(Image.created_at, Image.id)
+            .with_for_update()
+        )
+        result = await self.db.execute(stmt)
+        return list(result.scalars().all())
+
+    async def get_shared_upload_names(self, legacy_prefix: str) -> List[str]:
+        """Имена файлов, загруженных в старой структуре больше одного раза.
+
+        В старой структуре оригинал хранился как <prefix><uuid>_<имя>,
+        а thumbnails - под <имя>, поэтому загрузки с одинаковым именем
+        перезаписывали thumbnails друг друга. Учитываются изображения,
+        путь которых начинается с legacy_prefix и не содержит
+        поддиректорий.
+        """
+        names = (
+            select(
+                func.regexp_replace(
+                    Image.original_url, r"^(.*/)?([^_]{36}_)?", ""
+                ).label("name")
+            )
+            .where(
+                Image.original_url.like(f"{legacy_prefix}%"),
+                Image.original_url.not_like(f"{legacy_prefix}%/%")
+            )
+            .subquery()
+        )
+        stmt = (
+            select(names.c.name)
+            .group_by(names.c.name)
+            .having(func.count() > 1)
+        )
+        result = await self.db.execute(stmt)
+        return list(result.scalars().all())
+
+    async def set_file_paths(
+            self,
+            image_id: UUID,
+            original_url: str,
+            thumbnails: Optional[dict] = None
+    ) -> None:
+        """Обновить пути к файлам изображения.
+
+        updated_at не меняется: перенос файлов не считается обновлением
+        изображения. Транзакция не фиксируется.
+        """
+        values: dict = {
+            "original_url": original_url,
+            "updated_at": Image.updated_at
+        }
+        if thumbnails is not None:
+            values["thumbnails"] = thumbnails
+        stmt = (
+            update(Image)
+            .where(Image.id == image_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.execute(stmt)
+
     async def update_image_status(
             self,
             image_id: UUID,
             status: ImageStatus
     ) -> bool:
-        """Обновить статус изображения."""
+        """Обновить статус изображения.
+
+        При переходе в DONE или ERROR запоминается время завершения
+        обработки.
+        """
         logger.info("Обновление статуса изображения %s", image_id)
 
+        values: dict = {"status": status}
+        if status in (ImageStatus.DONE, ImageStatus.ERROR):
+            values["finished_at"] = func.now()
         stmt = (
             update(Image)
             .where(Image.id == image_id)
-            .values(status=status)
+            .values(**values)
         )
         result = await self.db.execute(stmt)
         await self.db.commit()
@@ -68,15 +228,22 @@ class ImageRepository:
     async def update_image_thumbnails(
             self,
             image_id: UUID,
-            thumbnails: dict
+            thumbnails: dict,
+            phash: Optional[int] = None,
+            placeholder: Optional[str] = None
     ) -> bool:
-        """Обновить thumbnails изображения."""
+        """Обновить thumbnails, перцептивный хеш и placeholder."""
         logger.info("Обновление thumbnails изображения %s", image_id)
 
+        values: dict = {"thumbnails": thumbnails}
+        if phash is not None:
+            values["phash"] = to_signed64(phash)
+        if placeholder is not None:
+            values["placeholder"] = placeholder
         stmt = (
             update(Image)
             .where(Image.id == image_id)
-            .values(thumbnails=thumbnails)
+            .values(**values)
         )
         result = await self.db.execute(stmt)
         await self.db.commit()
@@ -88,3 +255,116 @@ class ImageRepository:
             logger.warning("Не удалось обновить thumbnails", image_id)
 
         return success
+
+    async def mark_enqueued(self, image_id: UUID) -> None:
+        """Отметить, что задача изображения отправлена в очередь.
+
+        updated_at не меняется: отметка не считается обновлением
+        изображения.
+        """
+        stmt = (
+            update(Image)
+            .where(Image.id == image_id)
+            .values(enqueued_at=func.now(), updated_at=Image.updated_at)
+        )
+        await self.db.execute(stmt)
+        await self.db.commit()
+
+    async def claim_stale_images(
+            self,
+            lease_seconds: int,
+            batch_size: int,
+            include_enqueued: bool
+    ) -> List[Image]:
+        """Заблокировать пачку изображений с истекшей арендой.
+
+        Выбираются изображения, не обновлявшиеся дольше lease_seconds:
+        в статусе PROCESSING и в статусе NEW, задача для которых не была
+        отправлена в очередь. Если include_enqueued, выбираются и NEW
+        с отправленной задачей.
+        SKIP LOCKED позволяет нескольким reaper'ам работать параллельно
+        без пересечений. Транзакция не фиксируется: блокировки держатся
+        до commit в вызывающем коде.
+        """
+        cutoff = func.now() - timedelta(seconds=lease_seconds)
+        stale: ColumnElement[bool]
+        if include_enqueued:
+            stale = Image.status.in_(
+                [ImageStatus.NEW, ImageStatus.PROCESSING]
+            )
+        else:
+            stale = or_(
+                Image.status == ImageStatus.PROCESSING,
+                and_(
+                    Image.status == ImageStatus.NEW,
+                    Image.enqueued_at.is_(None)
+                )
+            )
+        stmt = (
+            select(Image)
+            .where(stale, Image.updated_at < cutoff)
+            .order_by(Image.updated_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        result = await self.db.execute(stmt)
+        return list(result.scalars().all())
+
+    async def requeue_images(self, image_ids: List[UUID]) -> int:
+        """Вернуть изображения в статус NEW и продлить их аренду.
+
+        Вызывается после отправки задач в очередь, поэтому изображения
+        сразу отмечаются отправленными.
+        """
+        stmt = (
+            update(Image)
+            .where(Image.id.in_(image_ids))
+            .values(
+                status=ImageStatus.NEW,
+                updated_at=func.now(),
+                enqueued_at=func.now()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.db.execute(stmt)
+        await self.db.commit()
+
+        logger.info("Изображения возвращены в очередь: %s", result.rowcount)
+        return result.rowcount
+
+    async def count_finished_since(self, seconds: int) -> int:
+        """Посчитать изображения, завершенные за последние seconds секунд.
+
+        Считается по finished_at, который ставит только worker, поэтому
+        другие изменения строк не искажают оценку.
+        """
+        stmt = (
+            select(func.count())
+            .select_from(Image)
+            .where(
+                Image.finished_at >= func.now() - timedelta(seconds=seconds)
+            )
+        )
+        result = await self.db.execute(stmt)
+        return result.scalar_one()
+
+    async def get_phashes_after(
+            self,
+            after: Optional[Tuple[datetime, UUID]],
+            batch_size: int
+    ) -> List[Tuple[UUID, int, datetime]]:
+        """Выбрать хеши обработанных изображений, обновленных после after.
+
+        Используется для инкрементальной загрузки индекса похожих
+        изображений: позиция (updated_at, id) работает как курсор.
+        """
+        stmt = select(Image.id, Image.phash, Image.updated_at).where(
+            Image.status == ImageStatus.DONE,
+            Image.phash.is_not(None)
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(Image.updated_at, Image.id) > after)
+        stmt = stmt.order_by(Image.updated_at, Image.id).limit(batch_size)
+
+        result = await self.db.execute(stmt)
+        return [tuple(row) for row in result.all()]
@@ -1,19 +1,71 @@
-from fastapi import APIRouter, UploadFile, File, Path, HTTPException, status
+from fastapi import (
+    APIRouter, Body, Depends, UploadFile, File, Path, Query, Request,
+    HTTPException, status
+)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
+from typing import AsyncIterator, Dict, List, Optional
 from uuid import UUID
 
-from app.backend.database.db import SessionDep
+from app.backend.database.db import SessionDep, async_session
+from app.backend.images.admission import AdmissionRejectedError, admission
+from app.backend.images.health import health_monitor
+from app.backend.images.models import ImageStatus
 from app.backend.images.service import ImageService
+from app.backend.images.similarity import MAX_DISTANCE
+from app.backend.images.sniffing import (
+    ImageTooLargeError, UnsupportedImageError
+)
+from app.backend.images.utils import decode_cursor
 from app.backend.logging_config import logger
+from app.backend.profiling import trace_span
 
 
 router = APIRouter(prefix="/images", tags=["images"])
 
+# Размер части при чтении загружаемого файла
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Наибольшее число ID в одном пакетном запросе
+MAX_LOOKUP_IDS = 500
+
+
+async def check_admission(request: Request) -> AsyncIterator[None]:
+    """Отклонить загрузку при перегрузке или превышении лимита клиента.
+
+    Загрузка учитывается в лимите клиента и глубине очереди, только
+    если она принята: при отклонении файла (413/415) или ошибке токен
+    клиента возвращается.
+    """
+    client = request.client.host if request.client else "unknown"
+    try:
+        admission.admit(client)
+    except AdmissionRejectedError as e:
+        logger.warning("Загрузка от %s отклонена: %s", client, e)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    try:
+        yield
+    except Exception:
+        admission.cancel(client)
+        raise
+    admission.accept()
+
+
+async def read_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+    """Читать загружаемый файл частями."""
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
 
 @router.post(
     "/",
     status_code=status.HTTP_200_OK,
-    summary="Загрузка изображений"
+    summary="Загрузка изображений",
+    dependencies=[Depends(check_admission)]
 )
 async def upload_image(
     db: SessionDep,
@@ -22,12 +74,25 @@ async def upload_image(
     """Загрузить изображение."""
     logger.info("Получен запрос на загрузку изображения %s", file.filename)
 
-    # Читаем содержимое файла
-    file_content = await file.read()
-
-    # Создаем сервис и обрабатываем загрузку
+    # Создаем сервис и обрабатываем загрузку по частям
     service = ImageService(db)
-    result = await service.upload_image(file_content, file.filename)
+    try:
+        with trace_span("upload_image"):
+            result = await service.upload_image(
+                read_chunks(file), file.filename
+            )
+    except ImageTooLargeError as e:
+        logger.warning("Изображение %s отклонено: %s", file.filename, e)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except UnsupportedImageError as e:
+        logger.warning("Изображение %s отклонено: %s", file.filename, e)
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=str(e)
+        )
 
     logger.info("Изображение %s успешно загружено с ID %s",
                 file.filename, result["id"])
@@ -35,20 +100,91 @@ async def upload_image(
     return result
 
 
+@router.get(
+    "/",
+    status_code=status.HTTP_200_OK,
+    summary="Список изображений с keyset-пагинацией"
+)
+async def list_images(
+    image_status: Optional[ImageStatus] = Query(None, alias="status"),
+    after: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=1000)
+) -> StreamingResponse:
+    """Получить страницу изображений в порядке создания."""
+    logger.info("Получен запрос на список изображений")
+
+    try:
+        position = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+    async def content() -> AsyncIterator[bytes]:
+        # Сессия открывается внутри генератора: зависимость get_db
+        # закрывается до того, как начнется отправка тела ответа
+        async with async_session() as session:
+            service = ImageService(session)
+            async for chunk in service.stream_image_list(
+                    image_status, position, limit):
+                yield chunk
+
+    return StreamingResponse(content(), media_type="application/json")
+
+
+@router.post(
+    "/lookup",
+    status_code=status.HTTP_200_OK,
+    summary="Пакетное получение информации об изображениях"
+)
+async def lookup_images(
+    db: SessionDep,
+    ids: List[UUID] = Body(..., embed=True, max_length=MAX_LOOKUP_IDS)
+) -> Response:
+    """Получить информацию о нескольких изображениях одним запросом."""
+    service = ImageService(db)
+    content = await service.lookup_images(ids)
+
+    # Ответ уже сериализован: обходим jsonable_encoder
+    return Response(content=content, media_type="application/json")
+
+
 @router.get(
     "/health",
     status_code=status.HTTP_200_OK,
     summary="Проверка состояния PostgreSQL и RabbitMQ"
 )
-async def health_check(db: SessionDep):
-    """Проверить состояние сервиса."""
-    logger.info("Получен запрос на проверку состояния сервиса")
+async def health_check() -> Dict:
+    """Получить последний результат проверки состояния сервиса."""
+    return health_monitor.snapshot()
 
-    service = ImageService(db)
-    result = await service.check_health()
 
-    logger.info("Проверка состояния сервиса завершена: %s", result)
-    return result
+@router.get(
+    "/health/live",
+    status_code=status.HTTP_200_OK,
+    summary="Liveness-проба"
+)
+async def liveness_probe() -> Dict:
+    """Процесс жив и event loop обрабатывает запросы."""
+    return {"status": "ok"}
+
+
+@router.get(
+    "/health/ready",
+    status_code=status.HTTP_200_OK,
+    summary="Readiness-проба"
+)
+async def readiness_probe() -> JSONResponse:
+    """Готов ли сервис принимать запросы.
+
+    Отдает сохраненный результат фоновой проверки, 503 - если БД
+    недоступна либо результат устарел. Состояние брокера попадает
+    в ответ, но на код влияет только при HEALTH_READY_REQUIRES_BROKER=1.
+    """
+    if not health_monitor.is_ready():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content=health_monitor.snapshot()
+        )
+    return JSONResponse(content=health_monitor.snapshot())
 
 
 @router.get(
@@ -72,3 +208,26 @@ async def get_image_info(
 
     logger.info("Информация об изображении %s успешно получена", id)
     return image_info
+
+
+@router.get(
+    "/{id}/similar",
+    status_code=status.HTTP_200_OK,
+    summary="Поиск похожих изображений"
+)
+async def get_similar_images(
+    db: SessionDep,
+    id: UUID = Path(...),
+    max_distance: int = Query(8, ge=0, le=MAX_DISTANCE)
+) -> Dict:
+    """Найти изображения, похожие на данное (повторно сжатые, уменьшенные)."""
+    logger.info("Получен запрос на поиск изображений, похожих на %s", id)
+
+    service = ImageService(db)
+    result = await service.find_similar(id, max_distance)
+
+    if result is None:
+        logger.warning("Изображение %s не найдено", id)
+        raise HTTPException(status_code=404, detail="Изображение не найдено")
+
+    return result
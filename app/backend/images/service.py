@@ -1,13 +1,23 @@
 import os
+import json
 import uuid
-from typing import Optional, Dict
-
-from sqlalchemy import text
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, Optional, Dict, List, Tuple
 
+from app.backend.images.models import Image, ImageStatus
 from app.backend.images.repository import ImageRepository
-from app.backend.images.rabbitmq import RabbitMQClient
+from app.backend.images.rabbitmq import (
+    PUBLISH_TIMEOUT, build_task_message, publisher
+)
+from app.backend.images.sniffing import ImageSniffer
+from app.backend.images.similarity import phash_index
+from app.backend.images.utils import (
+    encode_cursor, original_path, to_unsigned64
+)
 from app.backend.database.db import SessionDep
 from app.backend.logging_config import logger
+from app.backend.profiling import trace_span
 
 
 class ImageService:
@@ -16,28 +26,52 @@ class ImageService:
         self.repository = ImageRepository(db)
         self.rabbitmq_url = os.getenv("RABBITMQ_URL")
 
-    async def upload_image(self, file_content: bytes, filename: str) -> dict:
-        """Загрузить изображение и отправить задачу в очередь."""
-        # Сохраняем файл на диск
-        image_id = str(uuid.uuid4())
-        file_path = f"uploads/{image_id}_{filename}"
-
-        logger.info("Начало загрузки изображения %s с ID %s",
-                    filename, image_id)
-
-        # Создаем директорию uploads если её нет
-        os.makedirs("uploads", exist_ok=True)
-
-        # Сохраняем файл
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+    async def upload_image(
+            self,
+            chunks: AsyncIterator[bytes],
+            filename: str
+    ) -> dict:
+        """Загрузить изображение и отправить задачу в очередь.
+
+        Заголовок файла разбирается по мере поступления данных: файлы,
+        не являющиеся изображениями, и слишком большие изображения
+        отклоняются до записи на диск, в БД и в очередь.
+        """
+        # Разбираем заголовок, пока не станут известны размеры
+        sniffer = ImageSniffer()
+        header = None
+        async for chunk in chunks:
+            header = sniffer.feed(chunk)
+            if header is not None:
+                break
+        if header is None:
+            header = sniffer.close()
+
+        # Сохраняем файл на диск в директорию изображения
+        image_id = uuid.uuid4()
+        file_path = original_path(image_id, header.format)
+
+        logger.info("Начало загрузки изображения %s с ID %s: %s %sx%s",
+                    filename, image_id, header.format,
+                    header.width, header.height)
+
+        # Создаем директорию изображения если её нет
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        # Сохраняем файл: сначала уже прочитанный заголовок, затем остаток
+        with trace_span("write_file"), open(file_path, "wb") as f:
+            f.write(sniffer.buffer)
+            async for chunk in chunks:
+                f.write(chunk)
 
         # Создаем запись в БД
-        image = await self.repository.create_image(file_path)
+        image = await self.repository.create_image(
+            file_path, header, image_id
+        )
         logger.info("Изображение %s успешно сохранено в БД", image_id)
 
         # Отправляем задачу в RabbitMQ
-        await self.send_to_queue(image.id, file_path)
+        await self.send_to_queue(image)
         logger.info("Задача для изображения %s отправлена в очередь",
                     image_id)
 
@@ -46,34 +80,38 @@ class ImageService:
             "status": image.status.value
         }
 
-    async def send_to_queue(self, image_id: uuid.UUID, file_path: str) -> None:
+    async def send_to_queue(self, image: Image) -> None:
         """Отправить задачу в очередь RabbitMQ."""
-        task_id = str(uuid.uuid4())
+        message = build_task_message(image)
+        task_id = message["task_id"]
+        image_id = image.id
 
         try:
             logger.info("Отправка задачи %s для изображения %s в очередь",
                         task_id, image_id)
 
-            # Создаем клиента RabbitMQ
-            rabbit_client = RabbitMQClient()
-            rabbit_client.connect()
-
-            # Отправляем сообщение
-            message = {
-                "task_id": task_id,
-                "image_id": str(image_id),
-                "file_path": file_path
-            }
-
-            rabbit_client.send_message(message)
-            rabbit_client.disconnect()
+            # Отправляем сообщение через общее подключение приложения.
+            # Если брокер не отвечает, загрузка не ждет его дольше
+            # таймаута
+            with trace_span("send_to_queue"):
+                await asyncio.wait_for(
+                    publisher.send_message(message), timeout=PUBLISH_TIMEOUT
+                )
 
             logger.info("Задача %s для изображения %s успешно отправлена",
                         task_id, image_id)
+
+            # Изображения без отметки reaper переотправит после
+            # истечения аренды независимо от глубины очереди
+            await self.repository.mark_enqueued(image_id)
+        except asyncio.TimeoutError:
+            # Изображение остается без отметки enqueued_at, и reaper
+            # отправит его повторно
+            logger.error("Задача %s для изображения %s не отправлена за %s с",
+                         task_id, image_id, PUBLISH_TIMEOUT)
         except Exception as e:
             logger.error("Ошибка отправки задачи %s для изображения %s: %s",
                          task_id, image_id, str(e))
-            # В реальном приложении здесь должна быть обработка ошибок
 
     async def get_image_info(self, image_id: uuid.UUID) -> Optional[Dict]:
         """Получить информацию об изображении."""
@@ -85,43 +123,118 @@ class ImageService:
             return None
 
         logger.info("Информация об изображении %s успешно получена", image_id)
+        return self._image_info(image)
+
+    @staticmethod
+    def _image_info(image: Image) -> Dict:
         return {
             "id": str(image.id),
             "status": image.status.value,
             "original_url": image.original_url,
-            "thumbnails": image.thumbnails or {}
+            "thumbnails": image.thumbnails or {},
+            "placeholder": image.placeholder
         }
 
-    async def check_health(self) -> dict:
-        """Проверить состояние сервиса."""
-        logger.info("Начало проверки состояния сервиса")
-
-        health_status = {
-            "service": "ok",
-            "database": "unknown",
-            "rabbitmq": "unknown"
+    async def lookup_images(self, image_ids: List[uuid.UUID]) -> bytes:
+        """Получить информацию о нескольких изображениях одним запросом.
+
+        Результат возвращается уже сериализованным в JSON в порядке
+        запрошенных ID; отсутствующие изображения помечаются found=false.
+        """
+        # Убираем повторы, сохраняя порядок
+        unique_ids = list(dict.fromkeys(image_ids))
+        images = await self.repository.get_images_by_ids(unique_ids)
+        by_id = {image.id: image for image in images}
+
+        items = []
+        for image_id in unique_ids:
+            image = by_id.get(image_id)
+            if image is None:
+                items.append({"id": str(image_id), "found": False})
+            else:
+                items.append({**self._image_info(image), "found": True})
+
+        logger.info("Пакетный запрос изображений: запрошено %s, найдено %s",
+                    len(unique_ids), len(images))
+        return json.dumps(
+            {"items": items}, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+
+    async def stream_image_list(
+            self,
+            status: Optional[ImageStatus],
+            after: Optional[Tuple[datetime, uuid.UUID]],
+            limit: int
+    ) -> AsyncIterator[bytes]:
+        """Отдать страницу изображений в виде потока JSON.
+
+        Строки сериализуются по мере чтения из БД, без сборки всей
+        страницы в памяти. Выбирается limit + 1 строка, чтобы понять,
+        есть ли следующая страница.
+        """
+        yield b'{"items":['
+
+        count = 0
+        last = None
+        async for image in self.repository.stream_images(
+                status, after, limit + 1):
+            if count == limit:
+                break
+            item = {
+                "id": str(image.id),
+                "status": image.status.value,
+                "original_url": image.original_url,
+                "thumbnails": image.thumbnails or {},
+                "placeholder": image.placeholder,
+                "created_at": image.created_at.isoformat()
+            }
+            prefix = b"," if count else b""
+            yield prefix + json.dumps(item, ensure_ascii=False).encode()
+            count += 1
+            last = image
+        else:
+            # Строка сверх лимита не найдена - это последняя страница
+            last = None
+
+        next_cursor = (
+            encode_cursor(last.created_at, last.id) if last else None
+        )
+        yield b'],"next_cursor":' + json.dumps(next_cursor).encode() + b"}"
+        logger.info("Отдано изображений: %s", count)
+
+    async def find_similar(
+            self,
+            image_id: uuid.UUID,
+            max_distance: int
+    ) -> Optional[Dict]:
+        """Найти изображения, похожие на данное по перцептивному хешу.
+
+        Возвращает None, если изображения нет, и пустой список похожих,
+        если изображение еще не обработано.
+        """
+        logger.info("Поиск изображений, похожих на %s", image_id)
+
+        image_hash = phash_index.get(image_id)
+        if image_hash is None:
+            # Индекс может еще не догрузиться - берем хеш из БД
+            image = await self.repository.get_image_by_id(image_id)
+            if not image:
+                return None
+            if image.phash is not None:
+                image_hash = to_unsigned64(image.phash)
+
+        similar = []
+        if image_hash is not None:
+            similar = [
+                {"id": str(other_id), "distance": distance}
+                for other_id, distance in phash_index.search(
+                    image_hash, max_distance)
+                if other_id != image_id
+            ]
+
+        logger.info("Найдено похожих изображений: %s", len(similar))
+        return {
+            "id": str(image_id),
+            "processed": image_hash is not None,
+            "similar": similar
         }
-
-        # Проверяем подключение к БД
-        try:
-            # Простая проверка подключения
-            await self.db.execute(text("SELECT 1"))
-            health_status["database"] = "ok"
-            logger.info("Подключение к базе данных успешно")
-        except Exception as e:
-            health_status["database"] = f"error: {str(e)}"
-            logger.error("Ошибка подключения к базе данных: %s", str(e))
-
-        # Проверяем подключение к RabbitMQ
-        try:
-            rabbit_client = RabbitMQClient()
-            rabbit_client.connect()
-            rabbit_client.disconnect()
-            health_status["rabbitmq"] = "ok"
-            logger.info("Подключение к RabbitMQ успешно")
-        except Exception as e:
-            health_status["rabbitmq"] = f"error: {str(e)}"
-            logger.error("Ошибка подключения к RabbitMQ: %s", str(e))
-
-        logger.info("Проверка состояния сервиса завершена: %s", health_status)
-        return health_status
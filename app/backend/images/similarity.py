@@ -0,0 +1,401 @@
+import os
+import asyncio
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from app.backend.database.db import async_session
+from app.backend.images.repository import ImageRepository
+from app.backend.images.utils import to_unsigned64
+from app.backend.logging_config import logger
+
+# Период подгрузки новых хешей в индекс, секунды
+REFRESH_SECONDS = float(os.getenv("PHASH_REFRESH_SECONDS", "10"))
+# Сколько последних секунд перечитывается при каждой подгрузке
+RESCAN_MARGIN = timedelta(seconds=30)
+# Размер пачки при загрузке хешей из БД
+LOAD_BATCH_SIZE = int(os.getenv("PHASH_LOAD_BATCH_SIZE", "10000"))
+# Снимок индекса, с которого загрузка продолжается после перезапуска;
+# пустое значение отключает снимки
+SNAPSHOT_PATH = os.getenv(
+    "PHASH_SNAPSHOT_PATH", os.path.join("data", "phash_index.npz")
+)
+# Сколько новых хешей может накопиться до перестройки основной части
+MIN_PENDING = int(os.getenv("PHASH_MIN_PENDING", "50000"))
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Наибольшее расстояние Хэмминга, для которого поиск остается быстрым
+MAX_DISTANCE = 12
+
+Position = Tuple[datetime, UUID]
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(radius: int) -> np.ndarray:
+    """Все маски CHUNK_BITS бит, в которых не больше radius единиц."""
+    values = np.arange(1 << CHUNK_BITS, dtype=np.int64)
+    masks = values[np.bitwise_count(values) <= radius]
+    masks.setflags(write=False)
+    return masks
+
+
+def _key(image_id: UUID) -> np.bytes_:
+    """ID изображения в виде элемента массива ids."""
+    key: np.bytes_ = np.frombuffer(image_id.bytes, dtype="S16")[0]
+    return key
+
+
+def _to_uuids(ids: np.ndarray) -> List[UUID]:
+    # Элементы S16 теряют нулевые байты в конце, поэтому ID режем
+    # из общего буфера
+    raw = ids.tobytes()
+    return [UUID(bytes=raw[pos:pos + 16]) for pos in range(0, len(raw), 16)]
+
+
+@dataclass(frozen=True)
+class _Segment:
+    """Неизменяемая основная часть индекса.
+
+    ids (UUID.bytes) и hashes отсортированы по ID. Для каждой части
+    хеша rows - номера строк, упорядоченные по значению части, а
+    offsets[v]:offsets[v + 1] - диапазон строк со значением v.
+    """
+
+    ids: np.ndarray
+    hashes: np.ndarray
+    rows: Tuple[np.ndarray, ...]
+    offsets: Tuple[np.ndarray, ...]
+
+    @classmethod
+    def build(cls, ids: np.ndarray, hashes: np.ndarray) -> "_Segment":
+        """Построить сегмент; не обращается к состоянию индекса."""
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        hashes = hashes[order]
+
+        rows = []
+        offsets = []
+        for index in range(CHUNKS):
+            chunk = (
+                (hashes >> np.uint64(index * CHUNK_BITS))
+                & np.uint64(CHUNK_MASK)
+            ).astype(np.uint16)
+            rows.append(np.argsort(chunk, kind="stable").astype(np.int32))
+            offset = np.zeros((1 << CHUNK_BITS) + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(chunk, minlength=1 << CHUNK_BITS),
+                out=offset[1:]
+            )
+            offsets.append(offset)
+
+        return cls(ids, hashes, tuple(rows), tuple(offsets))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def find(self, image_id: UUID) -> int:
+        """Номер строки изображения или -1."""
+        key = _key(image_id)
+        row = int(np.searchsorted(self.ids, key))
+        if row < len(self.ids) and self.ids[row] == key:
+            return row
+        return -1
+
+    def candidates(self, value: int, radius: int) -> np.ndarray:
+        """Строки, у которых хотя бы одна часть хеша в радиусе radius."""
+        masks = _flip_masks(radius)
+        parts = []
+        for index in range(CHUNKS):
+            chunk = (value >> (index * CHUNK_BITS)) & CHUNK_MASK
+            neighbours = masks ^ chunk
+            starts = self.offsets[index][neighbours]
+            lengths = self.offsets[index][neighbours + 1] - starts
+            total = int(lengths.sum())
+            if not total:
+                continue
+            # Склеиваем диапазоны строк без цикла по соседям
+            shifts = np.repeat(starts - (np.cumsum(lengths) - lengths),
+                               lengths)
+            parts.append(self.rows[index][np.arange(total) + shifts])
+
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        rows: np.ndarray = np.unique(np.concatenate(parts))
+        return rows
+
+
+class PerceptualHashIndex:
+    """Индекс перцептивных хешей для поиска по расстоянию Хэмминга.
+
+    Multi-index hashing: 64-битный хеш делится на 4 части по 16 бит,
+    каждая часть - ключ своей таблицы. Если расстояние между хешами
+    не больше d, то хотя бы одна часть отличается не больше чем на
+    d // 4 бит, поэтому достаточно просмотреть соседей каждой части
+    в этом радиусе и проверить найденных кандидатов.
+
+    Основная часть хранится в numpy-массивах (около 45 байт на хеш),
+    новые хеши копятся в pending и проверяются перебором, пока их не
+    станет достаточно для перестройки. Индекс меняется только фоновой
+    задачей загрузки.
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = SNAPSHOT_PATH) -> None:
+        self.snapshot_path = snapshot_path
+        self.segment = _Segment.build(
+            np.empty(0, dtype="S16"), np.empty(0, dtype=np.uint64)
+        )
+        # Строки segment, хеш которых заменен или удален
+        self.removed = np.zeros(0, dtype=bool)
+        self.removed_count = 0
+        # Хеши, добавленные после построения segment
+        self.pending: Dict[UUID, int] = {}
+        self._pending_arrays: Optional[Tuple[List[UUID], np.ndarray]] = None
+        # Позиция (updated_at, id), до которой хеши уже загружены
+        self.position: Optional[Position] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.segment) - self.removed_count + len(self.pending)
+
+    def add(self, image_id: UUID, value: int) -> None:
+        """Добавить или обновить хеш изображения."""
+        if self.pending.get(image_id) == value:
+            return
+        row = self.segment.find(image_id)
+        if row >= 0 and not self.removed[row]:
+            if int(self.segment.hashes[row]) == value:
+                return
+            self.removed[row] = True
+            self.removed_count += 1
+        self.pending[image_id] = value
+        self._pending_arrays = None
+
+    def remove(self, image_id: UUID) -> None:
+        """Удалить хеш изображения из индекса."""
+        if self.pending.pop(image_id, None) is not None:
+            self._pending_arrays = None
+        row = self.segment.find(image_id)
+        if row >= 0 and not self.removed[row]:
+            self.removed[row] = True
+            self.removed_count += 1
+
+    def get(self, image_id: UUID) -> Optional[int]:
+        value = self.pending.get(image_id)
+        if value is not None:
+            return value
+        row = self.segment.find(image_id)
+        if row >= 0 and not self.removed[row]:
+            return int(self.segment.hashes[row])
+        return None
+
+    def _pending(self) -> Tuple[List[UUID], np.ndarray]:
+        if self._pending_arrays is None:
+            self._pending_arrays = (
+                list(self.pending),
+                np.fromiter(self.pending.values(), dtype=np.uint64,
+                            count=len(self.pending))
+            )
+        return self._pending_arrays
+
+    def search(
+            self,
+            value: int,
+            max_distance: int
+    ) -> List[Tuple[UUID, int]]:
+        """Найти изображения на расстоянии не больше max_distance.
+
+        Результат отсортирован по расстоянию.
+        """
+        target = np.uint64(value)
+
+        rows = self.segment.candidates(value, max_distance // CHUNKS)
+        rows = rows[~self.removed[rows]]
+        distances = np.bitwise_count(self.segment.hashes[rows] ^ target)
+        close = distances <= max_distance
+        found = list(zip(
+            _to_uuids(self.segment.ids[rows[close]]),
+            distances[close].tolist()
+        ))
+
+        pending_ids, pending_hashes = self._pending()
+        if pending_ids:
+            distances = np.bitwise_count(pending_hashes ^ target)
+            for position in np.flatnonzero(distances <= max_distance):
+                found.append(
+                    (pending_ids[position], int(distances[position]))
+                )
+
+        found.sort(key=lambda item: item[1])
+        return found
+
+    def _merged(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Все актуальные хеши: строки segment и pending."""
+        alive = ~self.removed
+        ids = [self.segment.ids[alive]]
+        hashes = [self.segment.hashes[alive]]
+        if self.pending:
+            pending_ids, pending_hashes = self._pending()
+            ids.append(np.array([image_id.bytes for image_id in pending_ids],
+                                dtype="S16"))
+            hashes.append(pending_hashes)
+        return np.concatenate(ids), np.concatenate(hashes)
+
+    async def _rebuild(self) -> None:
+        """Перенести pending в основную часть и сохранить снимок."""
+        ids, hashes = self._merged()
+        position = self.position
+        # Сортировка идет в отдельном потоке; индекс в это время не
+        # меняется, так как его меняет только вызывающая задача
+        segment = await asyncio.to_thread(_Segment.build, ids, hashes)
+
+        self.segment = segment
+        self.removed = np.zeros(len(segment), dtype=bool)
+        self.removed_count = 0
+        self.pending = {}
+        self._pending_arrays = None
+
+        if self.snapshot_path and position is not None:
+            try:
+                await asyncio.to_thread(
+                    self._save_snapshot, segment, position
+                )
+            except OSError as e:
+                logger.warning("Не удалось сохранить снимок индекса "
+                               "похожих изображений: %s", str(e))
+
+    def _save_snapshot(self, segment: _Segment, position: Position) -> None:
+        assert self.snapshot_path is not None
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Несколько процессов API пишут один файл: каждый через свой
+        # временный файл с атомарной заменой
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                ids=segment.ids,
+                hashes=segment.hashes,
+                position_at=np.array(position[0].isoformat()),
+                position_id=np.array(str(position[1]))
+            )
+        os.replace(tmp_path, self.snapshot_path)
+        logger.info("Снимок индекса похожих изображений сохранен: %s хешей",
+                    len(segment))
+
+    def _read_snapshot(self) -> Tuple[_Segment, Position]:
+        assert self.snapshot_path is not None
+        with np.load(self.snapshot_path, allow_pickle=False) as data:
+            ids = data["ids"]
+            hashes = data["hashes"]
+            position = (
+                datetime.fromisoformat(str(data["position_at"])),
+                UUID(str(data["position_id"]))
+            )
+        return _Segment.build(ids, hashes), position
+
+    async def load_snapshot(self) -> bool:
+        """Загрузить снимок, если он есть; вернуть признак успеха."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            segment, position = await asyncio.to_thread(self._read_snapshot)
+        except Exception as e:
+            logger.warning("Не удалось прочитать снимок индекса похожих "
+                           "изображений: %s", str(e))
+            return False
+
+        self.segment = segment
+        self.removed = np.zeros(len(segment), dtype=bool)
+        self.removed_count = 0
+        self.pending = {}
+        self._pending_arrays = None
+        self.position = position
+        logger.info("Индекс похожих изображений загружен из снимка: "
+                    "%s хешей", len(segment))
+        return True
+
+    def _needs_rebuild(self) -> bool:
+        return len(self.pending) > max(MIN_PENDING, len(self.segment) // 4)
+
+    async def refresh(self) -> int:
+        """Подгрузить хеши, появившиеся с прошлой загрузки."""
+        loaded = 0
+        size_before = len(self)
+        # Транзакция, начатая раньше, может зафиксироваться уже после
+        # сдвига позиции, поэтому последние секунды перечитываются
+        position = self.position
+        if position is not None:
+            position = (position[0] - RESCAN_MARGIN, UUID(int=0))
+
+        while True:
+            async with async_session() as session:
+                repository = ImageRepository(session)
+                rows = await repository.get_phashes_after(
+                    position, LOAD_BATCH_SIZE
+                )
+
+            for image_id, value, updated_at in rows:
+                self.add(image_id, to_unsigned64(value))
+            if rows:
+                last_id, _, last_updated_at = rows[-1]
+                position = (last_updated_at, last_id)
+                if self.position is None or position > self.position:
+                    self.position = position
+            loaded += len(rows)
+
+            if self._needs_rebuild():
+                await self._rebuild()
+
+            if len(rows) < LOAD_BATCH_SIZE:
+                break
+            # Отдаем управление обработке запросов между пачками
+            await asyncio.sleep(0)
+
+        if len(self) != size_before:
+            logger.info("В индекс похожих изображений загружено %s хешей "
+                        "(всего %s)", loaded, len(self))
+        return loaded
+
+    async def _run(self) -> None:
+        await self.load_snapshot()
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Не удалось обновить индекс похожих изображений: %s",
+                    str(e)
+                )
+            await asyncio.sleep(REFRESH_SECONDS)
+
+    def start(self) -> None:
+        """Запустить фоновую загрузку индекса."""
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить фоновую загрузку и сохранить снимок индекса."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        if self.snapshot_path and self.pending:
+            await self._rebuild()
+
+
+# Глобальный индекс похожих изображений процесса API
+phash_index = PerceptualHashIndex()
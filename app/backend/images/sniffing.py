@@ -0,0 +1,319 @@
+import os
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+
+# Ограничения на размер изображения (защита от decompression bomb)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "20000"))
+# Сколько байт можно прочитать в поисках размеров изображения.
+# В JPEG перед SOF могут идти EXIF и ICC-профиль по 64 КБ каждый
+MAX_HEADER_BYTES = int(os.getenv("MAX_HEADER_BYTES", str(1024 * 1024)))
+
+# Маркеры JPEG SOF, в которых хранятся размеры кадра
+_JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF,
+}
+# Маркеры JPEG без поля длины
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+
+_EXIF_ORIENTATION_TAG = 0x0112
+# Флаги чанка VP8X
+_WEBP_EXIF_FLAG = 0x08
+_WEBP_ANIMATION_FLAG = 0x02
+
+
+class ImageRejectedError(ValueError):
+    """Загруженный файл не может быть принят как изображение."""
+
+
+class UnsupportedImageError(ImageRejectedError):
+    """Файл не является изображением поддерживаемого формата."""
+
+
+class ImageTooLargeError(ImageRejectedError):
+    """Размеры изображения превышают допустимые."""
+
+
+class _NeedMoreData(Exception):
+    """Заголовок обрывается, нужно дочитать данные."""
+
+
+@dataclass(frozen=True)
+class ImageHeader:
+    """Метаданные изображения, прочитанные из заголовка контейнера.
+
+    frames равен None, если число кадров не объявлено в заголовке
+    (GIF и анимированный WebP).
+    """
+
+    format: str
+    width: int
+    height: int
+    orientation: int = 1
+    frames: Optional[int] = 1
+
+
+def _need(data: bytes, end: int) -> None:
+    if len(data) < end:
+        raise _NeedMoreData()
+
+
+def _check_dimensions(width: int, height: int) -> None:
+    """Проверить размеры, как только они прочитаны из заголовка.
+
+    Проверка идет до разбора остальных чанков, чтобы слишком большое
+    изображение отклонялось, не дожидаясь конца заголовка.
+    """
+    if width <= 0 or height <= 0:
+        raise UnsupportedImageError("Некорректные размеры изображения")
+    if (
+        max(width, height) > MAX_IMAGE_SIDE
+        or width * height > MAX_IMAGE_PIXELS
+    ):
+        raise ImageTooLargeError(
+            f"Изображение {width}x{height} превышает допустимый размер"
+        )
+
+
+def _tiff_orientation(tiff: bytes) -> int:
+    """Прочитать EXIF orientation из TIFF-структуры первого IFD."""
+    try:
+        if tiff[:2] == b"II":
+            order = "<"
+        elif tiff[:2] == b"MM":
+            order = ">"
+        else:
+            return 1
+
+        (ifd_offset,) = struct.unpack_from(order + "I", tiff, 4)
+        (count,) = struct.unpack_from(order + "H", tiff, ifd_offset)
+        for index in range(count):
+            entry = ifd_offset + 2 + index * 12
+            tag, value_type = struct.unpack_from(order + "HH", tiff, entry)
+            if tag == _EXIF_ORIENTATION_TAG and value_type == 3:
+                (value,) = struct.unpack_from(order + "H", tiff, entry + 8)
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def _sniff_jpeg(data: bytes) -> ImageHeader:
+    orientation = 1
+    pos = 2
+    while True:
+        _need(data, pos + 2)
+        if data[pos] != 0xFF:
+            raise UnsupportedImageError("Поврежденная структура JPEG")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Байты-заполнители перед маркером
+            pos += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise UnsupportedImageError("В JPEG отсутствует заголовок кадра")
+
+        _need(data, pos + 4)
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        segment_end = pos + 2 + length
+
+        if marker == 0xE1:
+            _need(data, pos + 10)
+            if data[pos + 4:pos + 10] == b"Exif\0\0":
+                _need(data, segment_end)
+                orientation = _tiff_orientation(
+                    data[pos + 10:segment_end]
+                )
+        elif marker in _JPEG_SOF_MARKERS:
+            _need(data, pos + 9)
+            height, width = struct.unpack_from(">HH", data, pos + 5)
+            _check_dimensions(width, height)
+            return ImageHeader("jpeg", width, height, orientation)
+
+        pos = segment_end
+
+
+def _sniff_png(data: bytes, partial: bool) -> ImageHeader:
+    _need(data, 24)
+    if data[12:16] != b"IHDR":
+        raise UnsupportedImageError("В PNG отсутствует заголовок IHDR")
+    width, height = struct.unpack_from(">II", data, 16)
+    _check_dimensions(width, height)
+
+    orientation = 1
+    frames = 1
+    # Идем по чанкам до IDAT: acTL и eXIf должны стоять перед ним
+    pos = 8
+    try:
+        while True:
+            _need(data, pos + 8)
+            length, chunk_type = struct.unpack_from(">I4s", data, pos)
+            if chunk_type == b"IDAT":
+                break
+            chunk_end = pos + 8 + length
+            if chunk_type == b"acTL":
+                _need(data, pos + 12)
+                (frames,) = struct.unpack_from(">I", data, pos + 8)
+            elif chunk_type == b"eXIf":
+                _need(data, chunk_end)
+                orientation = _tiff_orientation(data[pos + 8:chunk_end])
+            # Длина + тип + данные + CRC
+            pos = chunk_end + 4
+    except _NeedMoreData:
+        # acTL и eXIf необязательны: за пределами бюджета заголовка
+        # используются значения по умолчанию
+        if not partial:
+            raise
+
+    return ImageHeader("png", width, height, orientation, frames)
+
+
+def _sniff_gif(data: bytes) -> ImageHeader:
+    _need(data, 10)
+    width, height = struct.unpack_from("<HH", data, 6)
+    _check_dimensions(width, height)
+    return ImageHeader("gif", width, height, frames=None)
+
+
+def _webp_orientation(data: bytes) -> int:
+    """Найти чанк EXIF в WebP и прочитать из него orientation.
+
+    По спецификации EXIF стоит после данных изображения, поэтому чанки
+    перебираются до конца RIFF-контейнера.
+    """
+    (riff_size,) = struct.unpack_from("<I", data, 4)
+    riff_end = 8 + riff_size
+    pos = 12
+    while pos + 8 <= riff_end:
+        _need(data, pos + 8)
+        chunk_type, length = struct.unpack_from("<4sI", data, pos)
+        chunk_end = pos + 8 + length
+        if chunk_type == b"EXIF":
+            _need(data, chunk_end)
+            exif = data[pos + 8:chunk_end]
+            # Некоторые кодировщики оставляют префикс APP1 из JPEG
+            if exif[:6] == b"Exif\0\0":
+                exif = exif[6:]
+            return _tiff_orientation(exif)
+        # Чанки выровнены по двум байтам
+        pos = chunk_end + (length & 1)
+    return 1
+
+
+def _sniff_webp(data: bytes, partial: bool) -> ImageHeader:
+    _need(data, 30)
+    chunk_type = data[12:16]
+
+    if chunk_type == b"VP8 ":
+        if data[23:26] != b"\x9d\x01\x2a":
+            raise UnsupportedImageError("Поврежденный заголовок WebP")
+        width, height = struct.unpack_from("<HH", data, 26)
+        width, height = width & 0x3FFF, height & 0x3FFF
+        _check_dimensions(width, height)
+        return ImageHeader("webp", width, height)
+
+    if chunk_type == b"VP8L":
+        if data[20] != 0x2F:
+            raise UnsupportedImageError("Поврежденный заголовок WebP")
+        (bits,) = struct.unpack_from("<I", data, 21)
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        _check_dimensions(width, height)
+        return ImageHeader("webp", width, height)
+
+    if chunk_type == b"VP8X":
+        flags = data[20]
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        _check_dimensions(width, height)
+
+        orientation = 1
+        if flags & _WEBP_EXIF_FLAG:
+            try:
+                orientation = _webp_orientation(data)
+            except _NeedMoreData:
+                # EXIF необязателен: за пределами бюджета заголовка
+                # используется orientation по умолчанию
+                if not partial:
+                    raise
+
+        animated = bool(flags & _WEBP_ANIMATION_FLAG)
+        return ImageHeader(
+            "webp", width, height, orientation,
+            frames=None if animated else 1
+        )
+
+    raise UnsupportedImageError("Неизвестный тип WebP")
+
+
+def _sniff_bmp(data: bytes) -> ImageHeader:
+    _need(data, 26)
+    width, height = struct.unpack_from("<ii", data, 18)
+    # Отрицательная высота означает порядок строк сверху вниз
+    height = abs(height)
+    _check_dimensions(width, height)
+    return ImageHeader("bmp", width, height)
+
+
+def sniff_image(data: bytes, partial: bool = False) -> ImageHeader:
+    """Определить формат и размеры изображения по началу файла.
+
+    Пиксели не декодируются. Бросает UnsupportedImageError для
+    неподдерживаемых форматов и ImageTooLargeError для слишком
+    больших изображений. Если заголовок обрывается, бросает
+    _NeedMoreData. С partial=True данных больше не будет: если размеры
+    уже известны, необязательные поля (число кадров, orientation) за
+    концом data принимают значения по умолчанию.
+    """
+    _need(data, 12)
+
+    if data[:3] == b"\xff\xd8\xff":
+        header = _sniff_jpeg(data)
+    elif data[:8] == b"\x89PNG\r\n\x1a\n":
+        header = _sniff_png(data, partial)
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        header = _sniff_gif(data)
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        header = _sniff_webp(data, partial)
+    elif data[:2] == b"BM":
+        header = _sniff_bmp(data)
+    else:
+        raise UnsupportedImageError("Неподдерживаемый формат изображения")
+
+    return header
+
+
+class ImageSniffer:
+    """Инкрементальный разбор заголовка по мере поступления данных."""
+
+    def __init__(self, max_header_bytes: int = MAX_HEADER_BYTES):
+        self.max_header_bytes = max_header_bytes
+        self.buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> Optional[ImageHeader]:
+        """Добавить данные; вернуть заголовок, как только он разобран."""
+        self.buffer += chunk
+        try:
+            return sniff_image(self.buffer)
+        except _NeedMoreData:
+            if len(self.buffer) < self.max_header_bytes:
+                return None
+
+        # Бюджет исчерпан: принимаем файл, если размеры уже прочитаны
+        try:
+            return sniff_image(self.buffer, partial=True)
+        except _NeedMoreData:
+            raise UnsupportedImageError("Заголовок изображения не найден")
+
+    def close(self) -> ImageHeader:
+        """Завершить разбор по концу данных."""
+        try:
+            return sniff_image(self.buffer)
+        except _NeedMoreData:
+            raise UnsupportedImageError("Файл изображения обрывается")
@@ -0,0 +1,81 @@
+import os
+import base64
+import hashlib
+from datetime import datetime
+from typing import Optional, Tuple
+from uuid import UUID
+
+# Корневая директория файлов изображений
+UPLOADS_DIR = "uploads"
+
+# Расширения файлов по формату из заголовка изображения
+ORIGINAL_EXTENSIONS = {
+    "jpeg": ".jpg",
+    "png": ".png",
+    "webp": ".webp",
+    "gif": ".gif",
+    "bmp": ".bmp",
+}
+# OpenCV не пишет GIF, а BMP без сжатия слишком велик - для них
+# thumbnails сохраняются в PNG
+THUMBNAIL_EXTENSIONS = {
+    "jpeg": ".jpg",
+    "webp": ".webp",
+}
+
+
+def encode_cursor(created_at: datetime, image_id: UUID) -> str:
+    """Закодировать позицию keyset-пагинации в непрозрачный курсор."""
+    raw = f"{created_at.isoformat()}|{image_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """Раскодировать курсор в пару (created_at, id).
+
+    Бросает ValueError, если курсор поврежден.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_at, image_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(image_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+def to_signed64(value: int) -> int:
+    """Перевести беззнаковое 64-битное число в знаковое для BIGINT."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned64(value: int) -> int:
+    """Перевести знаковое значение BIGINT обратно в беззнаковое."""
+    return value + (1 << 64) if value < 0 else value
+
+
+def image_dir(image_id: UUID) -> str:
+    """Директория файлов изображения: uploads/ab/cd/<id>.
+
+    Два уровня по 256 поддиректорий выбираются по хешу ID, поэтому
+    файлы распределяются равномерно и ни одна директория не разрастается.
+    """
+    digest = hashlib.md5(image_id.bytes).hexdigest()
+    return os.path.join(UPLOADS_DIR, digest[:2], digest[2:4], str(image_id))
+
+
+def original_path(image_id: UUID, image_format: Optional[str]) -> str:
+    """Путь к оригиналу изображения."""
+    extension = ORIGINAL_EXTENSIONS.get(image_format or "", "")
+    return os.path.join(image_dir(image_id), f"orig{extension}")
+
+
+def thumbnail_path(
+        image_id: UUID,
+        width: int,
+        height: int,
+        image_format: Optional[str]
+) -> str:
+    """Путь к thumbnail изображения."""
+    extension = THUMBNAIL_EXTENSIONS.get(image_format or "", ".png")
+    return os.path.join(image_dir(image_id), f"{width}x{height}{extension}")
@@ -4,9 +4,17 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 
+from app.backend.admin.router import router as admin_router
 from app.backend.database.db import engine, Base
+from app.backend.images.admission import admission
+from app.backend.images.health import health_monitor
+from app.backend.images.rabbitmq import publisher
+from app.backend.images.similarity import phash_index
 from app.backend.images.router import router as images_router
 from app.backend.logging_config import logger
+from app.backend.profiling import (
+    PROFILING_TOKEN, SLOW_REQUEST_MS, slow_request_middleware
+)
 
 
 async def create_tables():
@@ -19,8 +27,15 @@ async def lifespan(app: FastAPI):
     logger.info("Запуск приложения. Создание таблиц в базе данных.")
     await create_tables()
     logger.info("Таблицы успешно созданы. Приложение готово к работе.")
+    health_monitor.start()
+    admission.start()
+    phash_index.start()
     yield
     logger.info("Завершение работы приложения.")
+    await phash_index.stop()
+    await health_monitor.stop()
+    await admission.stop()
+    await publisher.close()
 
 
 # Инициализация приложения
@@ -51,3 +66,10 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 # Подключаем роутеры
 app.include_router(images_router)
+
+# Профилирование и трассировка медленных запросов включаются явно,
+# выключенные они не добавляют накладных расходов
+if PROFILING_TOKEN:
+    app.include_router(admin_router)
+if SLOW_REQUEST_MS > 0:
+    app.middleware("http")(slow_request_middleware)
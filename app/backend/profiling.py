@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import signal
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from types import FrameType
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app.backend.logging_config import logger
+
+# Токен доступа к профилированию; если не задан, профилирование выключено
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+# Профилирование worker'а по сигналам включается явно
+PROFILING_SIGNALS = os.getenv("PROFILING_SIGNALS") == "1"
+# Порог медленного запроса в миллисекундах; 0 - трассировка выключена
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+# Длительность профиля, снимаемого worker'ом по сигналу, секунды
+SIGNAL_PROFILE_SECONDS = float(os.getenv("SIGNAL_PROFILE_SECONDS", "30"))
+# Куда worker сохраняет профили
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+MAX_PROFILE_SECONDS = 120
+SAMPLE_INTERVAL = 0.005
+
+# Верхние кадры простаивающих потоков: ожидание блокировки или события,
+# пустой пул потоков, event loop и pika в ожидании сокета. Такие потоки
+# CPU не тратят и в профиль не попадают
+IDLE_FRAMES = frozenset({
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+    ("select_connection.py", "poll"),
+})
+
+# Отрезки времени текущего запроса; None - трассировка не ведется
+_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar(
+    "spans", default=None
+)
+
+
+def sample_cpu(seconds: float, interval: float = SAMPLE_INTERVAL) -> str:
+    """Снять семплирующий CPU-профиль потоков процесса.
+
+    Раз в interval секунд снимаются стеки потоков, кроме простаивающих
+    в IDLE_FRAMES. Поток, ждущий внутри C-кода в другом месте (например,
+    time.sleep), все равно попадет в профиль. Результат - collapsed
+    stacks (формат flamegraph.pl и speedscope): стек через ";" и число
+    попаданий.
+    """
+    own_thread = threading.get_ident()
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread or _is_idle(frame):
+                continue
+            stack = []
+            current: Optional[FrameType] = frame
+            while current is not None:
+                code = current.f_code
+                stack.append(
+                    f"{code.co_name} "
+                    f"({os.path.basename(code.co_filename)}:"
+                    f"{code.co_firstlineno})"
+                )
+                current = current.f_back
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+
+    return "\n".join(
+        f"{stack} {count}" for stack, count in counts.most_common()
+    ) + "\n"
+
+
+def _is_idle(frame: FrameType) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def sample_memory(seconds: float, limit: int = 50) -> str:
+    """Показать, где выделялась память за seconds секунд.
+
+    tracemalloc включается только на время замера, если он не был
+    включен ранее.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(25)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    traced = sum(stat.size for stat in after.statistics("filename"))
+    lines = [f"# traced: {traced} bytes"]
+    lines.append("# top allocations by growth:")
+    for diff in after.compare_to(before, "lineno")[:limit]:
+        lines.append(str(diff))
+    lines.append("# top allocations by size:")
+    for stat in after.statistics("lineno")[:limit]:
+        lines.append(str(stat))
+    return "\n".join(lines) + "\n"
+
+
+PROFILERS: dict = {
+    "cpu": sample_cpu,
+    "memory": sample_memory,
+}
+
+
+@contextmanager
+def trace_span(name: str) -> Iterator[None]:
+    """Записать длительность блока в трассировку текущего запроса.
+
+    Если трассировка выключена, стоит одного чтения ContextVar.
+    """
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, (time.perf_counter() - start) * 1000))
+
+
+async def slow_request_middleware(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    """Залогировать разбивку по времени запросов дольше SLOW_REQUEST_MS."""
+    spans: List[Tuple[str, float]] = []
+    token = _spans.set(spans)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _spans.reset(token)
+
+    elapsed = (time.perf_counter() - start) * 1000
+    if elapsed > SLOW_REQUEST_MS:
+        logger.warning(
+            "Медленный запрос %s %s: %.1f мс (%s)",
+            request.method, request.url.path, elapsed,
+            ", ".join(f"{name}={ms:.1f} мс" for name, ms in spans)
+        )
+    return response
+
+
+def _profile_to_file(kind: str, profiler: Callable[[float], str]) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    extension = "collapsed" if kind == "cpu" else "txt"
+    path = os.path.join(
+        PROFILE_DIR, f"{kind}-{os.getpid()}-{timestamp}.{extension}"
+    )
+
+    logger.info("Снятие профиля %s на %s с", kind, SIGNAL_PROFILE_SECONDS)
+    result = profiler(SIGNAL_PROFILE_SECONDS)
+    with open(path, "w") as f:
+        f.write(result)
+    logger.info("Профиль %s сохранен в %s", kind, path)
+
+
+def install_signal_handlers() -> None:
+    """Снимать профиль по сигналу: SIGUSR1 - CPU, SIGUSR2 - память.
+
+    Профиль снимается в отдельном потоке и сохраняется в PROFILE_DIR.
+    Отправить сигнал может только владелец процесса.
+    """
+    def handler(kind: str) -> Callable:
+        def _handle(signum: int, frame: Optional[FrameType]) -> None:
+            threading.Thread(
+                target=_profile_to_file,
+                args=(kind, PROFILERS[kind]),
+                name=f"profiler-{kind}",
+                daemon=True
+            ).start()
+        return _handle
+
+    signal.signal(signal.SIGUSR1, handler("cpu"))
+    signal.signal(signal.SIGUSR2, handler("memory"))
+    logger.info("Профилирование по сигналам SIGUSR1/SIGUSR2 включено")
@@ -0,0 +1,173 @@
+import os
+import mmap
+import base64
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+# Буферы для resize живут в потоке пула: каждый поток переиспользует
+# свои массивы, поэтому синхронизация при доступе к ним не нужна
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_stats = {"allocated": 0, "reused": 0, "allocated_bytes": 0}
+
+
+# JPEG декодируется сразу в уменьшенном масштабе через IDCT-scaling
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def pick_decode_flags(metadata: Dict, target_side: int) -> int:
+    """Выбрать флаги декодирования по метаданным заголовка.
+
+    Если даже после уменьшения JPEG в 2/4/8 раз меньшая сторона не
+    меньше target_side, полный масштаб не нужен: декодирование
+    быстрее и требует в разы меньше памяти.
+    """
+    width = metadata.get("width")
+    height = metadata.get("height")
+    if metadata.get("format") != "jpeg" or not width or not height:
+        return cv2.IMREAD_COLOR
+
+    shortest = min(width, height)
+    for factor, flags in _REDUCED_DECODE_FLAGS:
+        if shortest // factor >= target_side:
+            return flags
+    return cv2.IMREAD_COLOR
+
+
+def decode_buffer(
+        data: Union[bytes, bytearray, memoryview, mmap.mmap],
+        flags: int = cv2.IMREAD_COLOR
+) -> Optional[np.ndarray]:
+    """Декодировать изображение из буфера в памяти без копирования."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    try:
+        return cv2.imdecode(buf, flags)
+    finally:
+        # Освобождаем экспорт буфера, иначе mmap нельзя будет закрыть
+        del buf
+
+
+def decode_image(
+        file_path: str,
+        flags: int = cv2.IMREAD_COLOR
+) -> Optional[np.ndarray]:
+    """Декодировать файл изображения через mmap.
+
+    Содержимое файла не читается в отдельный bytes-объект: декодер
+    работает прямо со страницами, отображенными в память.
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return decode_buffer(mm, flags)
+
+
+def _get_buffer(shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+    """Получить переиспользуемый массив текущего потока."""
+    buffers: Optional[Dict] = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+
+    key = (shape, np.dtype(dtype).str)
+    buf = buffers.get(key)
+    if buf is None:
+        buf = np.empty(shape, dtype=dtype)
+        buffers[key] = buf
+        with _stats_lock:
+            _stats["allocated"] += 1
+            _stats["allocated_bytes"] += buf.nbytes
+    else:
+        with _stats_lock:
+            _stats["reused"] += 1
+
+    return buf
+
+
+def _write_all(path: str, data: np.ndarray) -> None:
+    """Записать закодированный буфер в файл одним вызовом write."""
+    view = data.reshape(-1).data
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # write может записать не все байты, дописываем остаток
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+
+
+def dhash(img: np.ndarray) -> int:
+    """Вычислить 64-битный разностный перцептивный хеш (dHash).
+
+    Изображение сжимается до 9x8 в оттенках серого, каждый бит -
+    сравнение яркости соседних пикселей в строке. Хеш устойчив к
+    перекодированию и изменению размера.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def make_thumbnail(
+        img: np.ndarray,
+        width: int,
+        height: int,
+        path: str,
+        compute_hash: bool = False
+) -> Tuple[bool, Optional[int]]:
+    """Создать thumbnail и сохранить его по пути path.
+
+    Результат resize пишется в буфер потока, кодирование идет в память,
+    формат выбирается по расширению path, как в cv2.imwrite. Если
+    compute_hash, по thumbnail вычисляется dHash, пока буфер не
+    переиспользован. Возвращает признак успеха и хеш.
+    """
+    dst = _get_buffer((height, width) + img.shape[2:], img.dtype)
+    cv2.resize(img, (width, height), dst=dst)
+    image_hash = dhash(dst) if compute_hash else None
+
+    extension = os.path.splitext(path)[1] or ".jpg"
+    success, encoded = cv2.imencode(extension, dst)
+    if not success:
+        return False, image_hash
+
+    _write_all(path, encoded)
+    return True, image_hash
+
+
+def make_placeholder(img: np.ndarray, max_side: int = 20) -> Optional[str]:
+    """Создать крошечный размытый placeholder в виде WebP data URI.
+
+    Пропорции сохраняются, большая сторона - max_side пикселей.
+    Результат занимает несколько сотен байт и отдается вместе с
+    метаданными изображения.
+    """
+    height, width = img.shape[:2]
+    scale = max_side / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+    success, encoded = cv2.imencode(
+        ".webp", small, [cv2.IMWRITE_WEBP_QUALITY, 30]
+    )
+    if not success:
+        return None
+    return "data:image/webp;base64," + base64.b64encode(
+        encoded.tobytes()).decode()
+
+
+def buffer_stats() -> Dict[str, int]:
+    """Статистика выделений буферов для resize."""
+    with _stats_lock:
+        return dict(_stats)
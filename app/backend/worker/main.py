@@ -1,6 +1,5 @@
 import os
 import sys
-import cv2
 import uuid
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
@@ -9,7 +8,13 @@ from app.backend.database.db import async_session
 from app.backend.images.models import ImageStatus
 from app.backend.images.repository import ImageRepository
 from app.backend.images.rabbitmq import RabbitMQClient
+from app.backend.images.utils import image_dir, thumbnail_path
 from app.backend.logging_config import logger
+from app.backend.profiling import PROFILING_SIGNALS, install_signal_handlers
+from app.backend.worker.imaging import (
+    buffer_stats, decode_image, make_placeholder, make_thumbnail,
+    pick_decode_flags
+)
 
 # Создаем пул потоков для выполнения блокирующих операций
 executor = ThreadPoolExecutor(max_workers=4)
@@ -39,9 +44,17 @@ async def process_image(message):
             )
             logger.info("Статус изображения %s обновлен", image_id)
 
-            # Загружаем изображение асинхронно
+            # Загружаем изображение асинхронно, масштаб декодирования
+            # выбираем по метаданным, прочитанным при загрузке
+            metadata = message.get("metadata") or {}
+            sizes = [(100, 100), (300, 300), (1200, 1200)]
+            flags = pick_decode_flags(
+                metadata, max(max(size) for size in sizes)
+            )
             loop = asyncio.get_event_loop()
-            img = await loop.run_in_executor(executor, cv2.imread, file_path)
+            img = await loop.run_in_executor(
+                executor, decode_image, file_path, flags
+            )
             if img is None:
                 raise ValueError(
                     "Не удалось загрузить изображение. "
@@ -49,42 +62,38 @@ async def process_image(message):
                     "неподдерживаемый формат."
                 )
 
-            # Создаем thumbnails
+            # Placeholder строим из уже декодированного изображения
+            placeholder = await loop.run_in_executor(
+                executor, make_placeholder, img
+            )
+
+            # Создаем thumbnails; перцептивный хеш считаем по самому
+            # маленькому из них
             thumbnails = {}
-            sizes = [(100, 100), (300, 300), (1200, 1200)]
+            image_hash = None
+            smallest = min(sizes)
 
-            logger.info("Создание thumbnails для изображения", image_id)
+            logger.info("Создание thumbnails для изображения %s", image_id)
+
+            # Thumbnails лежат рядом с оригиналом в директории изображения
+            os.makedirs(image_dir(uuid.UUID(image_id)), exist_ok=True)
 
             for width, height in sizes:
-                # Изменяем размер изображения асинхронно
-                resized = await loop.run_in_executor(
-                    executor,
-                    lambda img=img,
-                    w=width,
-                    h=height: cv2.resize(img, (w, h))
+                thumb_filename = thumbnail_path(
+                    uuid.UUID(image_id), width, height,
+                    metadata.get("format")
                 )
 
-                # Сохраняем thumbnail асинхронно
-                # Упрощаем имя файла для thumbnail
-                original_basename = os.path.basename(file_path)
-                # Убираем UUID из начала имени файла если он есть
-                if "_" in original_basename:
-                    # Формат имени: UUID_original_filename
-                    parts = original_basename.split("_", 1)
-                    # Проверяем, что первая часть - это UUID
-                    if len(parts) == 2 and len(parts[0]) == 36:
-                        simplified_name = parts[1]
-                    else:
-                        simplified_name = original_basename
-                else:
-                    simplified_name = original_basename
-
-                thumb_filename = f"u/t_{width}x{height}_{simplified_name}"
-
-                # Проверяем успешность сохранения
-                success = await loop.run_in_executor(
-                    executor, lambda: cv2.imwrite(thumb_filename, resized)
+                # Изменяем размер и сохраняем thumbnail асинхронно.
+                # Resize и кодирование идут в одном вызове, чтобы буфер
+                # потока не использовался одновременно другой задачей
+                success, thumb_hash = await loop.run_in_executor(
+                    executor, make_thumbnail,
+                    img, width, height, thumb_filename,
+                    (width, height) == smallest
                 )
+                if thumb_hash is not None:
+                    image_hash = thumb_hash
 
                 if not success:
                     raise IOError(
@@ -97,7 +106,7 @@ async def process_image(message):
 
             # Обновляем запись в БД с thumbnails и статусом DONE
             await repository.update_image_thumbnails(
-                uuid.UUID(image_id), thumbnails)
+                uuid.UUID(image_id), thumbnails, image_hash, placeholder)
             logger.info("Thumbnails для изображения %s созданы", image_id)
 
             await repository.update_image_status(
@@ -105,6 +114,7 @@ async def process_image(message):
             logger.info("Статус изображения %s обновлен", image_id)
 
             logger.info("Задача %s успешно завершена", task_id)
+            logger.info("Буферы thumbnails: %s", buffer_stats())
 
         except FileNotFoundError as e:
             logger.error("Ошибка при обработке задачи %s: %s", task_id, str(e))
@@ -169,6 +179,9 @@ if __name__ == "__main__":
         logger.error("Не установлена переменная окружения RABBITMQ_URL")
         sys.exit(1)
 
+    if PROFILING_SIGNALS:
+        install_signal_handlers()
+
     # Создаем клиента RabbitMQ
     rabbit_client = RabbitMQClient()
 
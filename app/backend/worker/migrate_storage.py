@@ -0,0 +1,409 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from app.backend.database.db import async_session
+from app.backend.images.models import Image, ImageStatus
+from app.backend.images.repository import ImageRepository
+from app.backend.images.rabbitmq import RabbitMQClient, build_task_message
+from app.backend.images.utils import (
+    UPLOADS_DIR, decode_cursor, encode_cursor, image_dir, original_path
+)
+from app.backend.logging_config import logger
+
+# Файл с позицией, до которой миграция уже дошла. Лежит вне uploads:
+# эта директория раздается публично, а в файле есть имена файлов
+# пользователей
+DEFAULT_CHECKPOINT = os.path.join("data", "layout_migration.json")
+# Пауза перед повторной попыткой для изображений в обработке, секунды
+RETRY_DELAY_SECONDS = 30
+# Интервал опроса глубины очереди, секунды
+QUEUE_POLL_SECONDS = 5
+
+# Формат изображения по расширению файла для записей, загруженных до
+# появления метаданных заголовка
+_FORMATS_BY_EXTENSION = {
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".png": "png",
+    ".webp": "webp",
+    ".gif": "gif",
+    ".bmp": "bmp",
+}
+
+# Префикс старого имени thumbnail: u/t_100x100_<имя исходного файла>
+_LEGACY_THUMBNAIL_PREFIX = re.compile(r"^t_\d+x\d+_")
+
+
+@dataclass
+class Checkpoint:
+    """Состояние миграции, сохраняемое между запусками."""
+
+    cursor: Optional[str] = None
+    # Изображения, пропущенные, пока их обрабатывал worker
+    skipped: List[str] = field(default_factory=list)
+    # Имена файлов, загруженных больше одного раза. Считаются один раз
+    # до переноса: после переноса старые имена из БД уже не получить
+    shared_names: Optional[List[str]] = None
+
+
+@dataclass
+class BatchResult:
+    """Итог переноса одной пачки."""
+
+    processed: int = 0
+    reprocessed: int = 0
+    missing: int = 0
+    in_flight: List[UUID] = field(default_factory=list)
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """Прочитать состояние миграции."""
+    if not os.path.exists(path):
+        return Checkpoint()
+    with open(path) as f:
+        data = json.load(f)
+    return Checkpoint(
+        cursor=data.get("cursor"),
+        skipped=data.get("skipped", []),
+        shared_names=data.get("shared_names")
+    )
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    """Атомарно сохранить состояние миграции."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(asdict(checkpoint), f)
+    os.replace(tmp_path, path)
+
+
+def move_original(image: Image) -> Optional[str]:
+    """Перенести оригинал в директорию изображения.
+
+    Возвращает новый путь или None, если файл не найден ни по старому,
+    ни по новому пути. Повторный вызов после сбоя безопасен.
+    """
+    old_path = image.original_url
+    extension = os.path.splitext(old_path)[1].lower()
+    image_format = image.format or _FORMATS_BY_EXTENSION.get(extension)
+    new_path = original_path(image.id, image_format)
+
+    if old_path == new_path:
+        return new_path
+
+    if os.path.exists(old_path):
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(old_path, new_path)
+    elif not os.path.exists(new_path):
+        # Файл мог быть перенесен в прошлый запуск до фиксации транзакции
+        logger.warning("Файл изображения %s не найден: %s",
+                       image.id, old_path)
+        return None
+
+    return new_path
+
+
+def move_thumbnails(
+        image: Image,
+        shared_names: Set[str]
+) -> Optional[Dict[str, str]]:
+    """Перенести thumbnails в директорию изображения.
+
+    Старые thumbnails лежат в общей директории под именем исходного
+    файла. Если это имя загружалось больше одного раза, файл мог быть
+    перезаписан чужой загрузкой - такие thumbnails не переносятся.
+    Возвращает новые пути или None, если thumbnails нужно создать
+    заново.
+    """
+    directory = image_dir(image.id)
+    moves: Dict[str, Tuple[str, str]] = {}
+    for size, old_path in (image.thumbnails or {}).items():
+        if old_path.startswith(directory):
+            moves[size] = (old_path, old_path)
+            continue
+        name = _LEGACY_THUMBNAIL_PREFIX.sub("", os.path.basename(old_path))
+        if name in shared_names:
+            return None
+        # Расширение сохраняется: старые thumbnails писались в формате
+        # оригинала, а не в формате по умолчанию для новой структуры
+        extension = os.path.splitext(old_path)[1]
+        moves[size] = (
+            old_path, os.path.join(directory, f"{size}{extension}")
+        )
+
+    if not all(
+        os.path.exists(old_path) or os.path.exists(new_path)
+        for old_path, new_path in moves.values()
+    ):
+        return None
+
+    for old_path, new_path in moves.values():
+        if old_path != new_path and os.path.exists(old_path):
+            os.makedirs(directory, exist_ok=True)
+            os.replace(old_path, new_path)
+    return {size: new_path for size, (_, new_path) in moves.items()}
+
+
+def has_legacy_thumbnails(image: Image) -> bool:
+    """Лежат ли thumbnails обработанного изображения вне его директории."""
+    if image.status != ImageStatus.DONE:
+        return False
+    directory = image_dir(image.id)
+    return any(
+        not path.startswith(directory)
+        for path in (image.thumbnails or {}).values()
+    )
+
+
+async def wait_for_queue(
+        rabbit_client: RabbitMQClient,
+        max_depth: int
+) -> None:
+    """Дождаться, пока в очереди останется не больше max_depth задач.
+
+    Иначе задачи миграции вытесняют новые загрузки и admission control
+    начинает отклонять их по прогнозу ожидания.
+    """
+    while True:
+        ready, _ = rabbit_client.get_queue_stats()
+        if ready <= max_depth:
+            return
+        logger.info("В очереди %s задач, отправка приостановлена", ready)
+        await asyncio.sleep(QUEUE_POLL_SECONDS)
+
+
+async def migrate_images(
+        repository: ImageRepository,
+        images: List[Image],
+        shared_names: Set[str],
+        reprocess: bool,
+        rabbit_client: Optional[RabbitMQClient]
+) -> BatchResult:
+    """Перенести файлы заблокированных изображений и зафиксировать."""
+    result = BatchResult(processed=len(images))
+    messages = []
+    for image in images:
+        original_url = image.original_url
+        if not original_url.startswith(image_dir(image.id)):
+            # Файлы задач в работе не трогаем: worker может их читать
+            if image.status in (ImageStatus.NEW, ImageStatus.PROCESSING):
+                result.in_flight.append(image.id)
+                continue
+            new_path = move_original(image)
+            if new_path is None:
+                result.missing += 1
+                continue
+            original_url = new_path
+
+        thumbnails = None
+        if has_legacy_thumbnails(image):
+            thumbnails = move_thumbnails(image, shared_names)
+            if thumbnails is None and reprocess:
+                message = build_task_message(image)
+                message["file_path"] = original_url
+                messages.append(message)
+
+        if original_url != image.original_url or thumbnails is not None:
+            await repository.set_file_paths(
+                image.id, original_url, thumbnails
+            )
+
+    await repository.db.commit()
+
+    # Отправляем после фиксации, чтобы worker читал уже новый путь.
+    # Если отправка упадет, повторный запуск отправит их снова
+    if messages and rabbit_client is not None:
+        rabbit_client.send_messages(messages)
+    result.reprocessed = len(messages)
+    return result
+
+
+async def migrate_batch(
+        after: Optional[Tuple],
+        batch_size: int,
+        shared_names: Set[str],
+        reprocess: bool,
+        rabbit_client: Optional[RabbitMQClient]
+) -> Tuple[BatchResult, Optional[Tuple]]:
+    """Перенести файлы одной пачки изображений.
+
+    Возвращает итог пачки и позицию последней строки.
+    """
+    async with async_session() as session:
+        repository = ImageRepository(session)
+        images = await repository.lock_images_page(after, batch_size)
+        if not images:
+            await session.rollback()
+            return BatchResult(), None
+
+        last = images[-1]
+        result = await migrate_images(
+            repository, images, shared_names, reprocess, rabbit_client
+        )
+        return result, (last.created_at, last.id)
+
+
+async def retry_skipped(
+        image_ids: List[UUID],
+        shared_names: Set[str],
+        reprocess: bool,
+        rabbit_client: Optional[RabbitMQClient]
+) -> BatchResult:
+    """Повторить перенос изображений, пропущенных из-за обработки."""
+    async with async_session() as session:
+        repository = ImageRepository(session)
+        images = await repository.lock_images_by_ids(image_ids)
+        return await migrate_images(
+            repository, images, shared_names, reprocess, rabbit_client
+        )
+
+
+async def load_shared_names(checkpoint: Checkpoint) -> Set[str]:
+    """Получить имена файлов, загруженных больше одного раза."""
+    if checkpoint.shared_names is None:
+        async with async_session() as session:
+            repository = ImageRepository(session)
+            checkpoint.shared_names = (
+                await repository.get_shared_upload_names(f"{UPLOADS_DIR}/")
+            )
+        logger.info("Имен файлов, загруженных несколько раз: %s",
+                    len(checkpoint.shared_names))
+    return set(checkpoint.shared_names)
+
+
+async def migrate(
+        batch_size: int,
+        rate: float,
+        checkpoint_path: str,
+        restart: bool,
+        reprocess: bool,
+        max_queue_depth: int,
+        retries: int
+) -> None:
+    """Перенести файлы всех изображений в шардированную структуру."""
+    checkpoint = load_checkpoint(checkpoint_path)
+    if restart:
+        checkpoint.cursor = None
+    after = decode_cursor(checkpoint.cursor) if checkpoint.cursor else None
+    shared_names = await load_shared_names(checkpoint)
+    save_checkpoint(checkpoint_path, checkpoint)
+    rabbit_client = RabbitMQClient() if reprocess else None
+
+    processed_total = 0
+    reprocessed_total = 0
+    missing_total = 0
+    skipped = set(checkpoint.skipped)
+    try:
+        while True:
+            if rabbit_client is not None:
+                await wait_for_queue(rabbit_client, max_queue_depth)
+
+            started = time.monotonic()
+            result, last = await migrate_batch(
+                after, batch_size, shared_names, reprocess, rabbit_client
+            )
+            if last is None:
+                break
+
+            after = last
+            skipped.update(str(image_id) for image_id in result.in_flight)
+            checkpoint.cursor = encode_cursor(*last)
+            checkpoint.skipped = sorted(skipped)
+            save_checkpoint(checkpoint_path, checkpoint)
+            processed_total += result.processed
+            reprocessed_total += result.reprocessed
+            missing_total += result.missing
+            logger.info(
+                "Миграция файлов: обработано %s, на пересоздание %s, "
+                "отложено %s",
+                processed_total, reprocessed_total, len(skipped)
+            )
+
+            # Ограничиваем скорость, чтобы не нагружать диск и БД
+            delay = result.processed / rate - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        # Изображения, которые обрабатывались при проходе, к этому
+        # времени обычно уже завершены
+        for attempt in range(retries):
+            if not skipped:
+                break
+            if attempt:
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+            logger.info("Повторный перенос отложенных изображений: %s",
+                        len(skipped))
+
+            pending = sorted(skipped)
+            for start in range(0, len(pending), batch_size):
+                if rabbit_client is not None:
+                    await wait_for_queue(rabbit_client, max_queue_depth)
+                chunk = pending[start:start + batch_size]
+                result = await retry_skipped(
+                    [UUID(image_id) for image_id in chunk],
+                    shared_names, reprocess, rabbit_client
+                )
+                skipped.difference_update(chunk)
+                skipped.update(
+                    str(image_id) for image_id in result.in_flight
+                )
+                checkpoint.skipped = sorted(skipped)
+                save_checkpoint(checkpoint_path, checkpoint)
+                reprocessed_total += result.reprocessed
+                missing_total += result.missing
+    finally:
+        if rabbit_client is not None:
+            rabbit_client.disconnect()
+
+    logger.info(
+        "Миграция файлов завершена: обработано %s, на пересоздание %s, "
+        "файлы не найдены %s",
+        processed_total, reprocessed_total, missing_total
+    )
+    if skipped:
+        logger.info("Все еще в обработке: %s изображений, они будут "
+                    "перенесены при следующем запуске", len(skipped))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Перенос файлов изображений в шардированную структуру"
+    )
+    parser.add_argument("--batch-size", type=int, default=200,
+                        help="Изображений в одной транзакции")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="Наибольшее число изображений в секунду")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT,
+                        help="Файл с позицией для продолжения миграции")
+    parser.add_argument("--restart", action="store_true",
+                        help="Начать с начала, игнорируя позицию")
+    parser.add_argument("--no-reprocess", action="store_true",
+                        help="Не пересоздавать thumbnails")
+    parser.add_argument("--max-queue-depth", type=int, default=20,
+                        help="Глубина очереди, при которой отправка "
+                             "задач приостанавливается")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="Повторных проходов по изображениям, "
+                             "пропущенным из-за обработки")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        logger.error("Не установлена переменная окружения DATABASE_URL")
+        sys.exit(1)
+    if not args.no_reprocess and not os.getenv("RABBITMQ_URL"):
+        logger.error("Не установлена переменная окружения RABBITMQ_URL")
+        sys.exit(1)
+
+    asyncio.run(migrate(
+        args.batch_size, args.rate, args.checkpoint, args.restart,
+        not args.no_reprocess, args.max_queue_depth, args.retries
+    ))
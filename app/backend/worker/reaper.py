@@ -0,0 +1,87 @@
+import os
+import sys
+import asyncio
+
+from app.backend.database.db import async_session
+from app.backend.images.repository import ImageRepository
+from app.backend.images.rabbitmq import RabbitMQClient, build_task_message
+from app.backend.logging_config import logger
+
+# Интервал между проходами, секунды
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL_SECONDS", "5"))
+# Сколько задача может оставаться в NEW/PROCESSING без обновлений
+REAPER_LEASE = int(os.getenv("REAPER_LEASE_SECONDS", "300"))
+# Размер пачки, блокируемой за один проход
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500"))
+
+
+async def reap_once(rabbit_client: RabbitMQClient) -> int:
+    """Переотправить одну пачку зависших изображений в очередь."""
+    # NEW без отметки об отправке восстанавливаются всегда: задача до
+    # очереди не дошла. Отправленные NEW могут просто ждать в очереди
+    # при большом бэклоге - потерянными их можно считать, только когда
+    # очередь пуста, иначе reaper будет плодить дубликаты
+    ready, _ = rabbit_client.get_queue_stats()
+
+    async with async_session() as session:
+        repository = ImageRepository(session)
+
+        images = await repository.claim_stale_images(
+            REAPER_LEASE, REAPER_BATCH_SIZE, include_enqueued=ready == 0
+        )
+        if not images:
+            await session.rollback()
+            return 0
+
+        messages = [build_task_message(image) for image in images]
+        # Если отправка упадет, транзакция откатится и строки
+        # останутся доступны следующему проходу
+        rabbit_client.send_messages(messages)
+
+        return await repository.requeue_images(
+            [image.id for image in images]
+        )
+
+
+async def run_reaper() -> None:
+    """Периодически возвращать в очередь задачи с истекшей арендой."""
+    rabbit_client = RabbitMQClient()
+    recovered_total = 0
+
+    try:
+        while True:
+            try:
+                recovered = await reap_once(rabbit_client)
+            except Exception as e:
+                logger.error("Ошибка reaper: %s", str(e))
+                rabbit_client.disconnect()
+                recovered = 0
+
+            if recovered:
+                recovered_total += recovered
+                logger.info(
+                    "Reaper восстановил %s задач (всего %s)",
+                    recovered, recovered_total
+                )
+
+            # Полная пачка - вероятно, есть еще, продолжаем без паузы
+            if recovered < REAPER_BATCH_SIZE:
+                await asyncio.sleep(REAPER_INTERVAL)
+    finally:
+        rabbit_client.disconnect()
+
+
+if __name__ == "__main__":
+    logger.info("Запуск reaper для зависших задач...")
+
+    if not os.getenv("DATABASE_URL"):
+        logger.error("Не установлена переменная окружения DATABASE_URL")
+        sys.exit(1)
+    if not os.getenv("RABBITMQ_URL"):
+        logger.error("Не установлена переменная окружения RABBITMQ_URL")
+        sys.exit(1)
+
+    try:
+        asyncio.run(run_reaper())
+    except KeyboardInterrupt:
+        logger.info("Остановка reaper")
@@ -0,0 +1,40 @@
+"""Add finished_at column for completion rate estimate
+
+Revision ID: 2c8e5b7d4f03
+Revises: 7a3d9e2f1c58
+Create Date: 2025-10-08 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c8e5b7d4f03'
+down_revision: Union[str, Sequence[str], None] = '7a3d9e2f1c58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('finished_at',
+                                      sa.DateTime(timezone=True),
+                                      nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_images_finished_at', 'images', ['finished_at'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_images_finished_at', table_name='images',
+            postgresql_concurrently=True
+        )
+    op.drop_column('images', 'finished_at')
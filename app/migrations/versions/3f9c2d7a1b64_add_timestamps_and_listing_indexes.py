@@ -0,0 +1,61 @@
+"""Add timestamps and listing indexes
+
+Revision ID: 3f9c2d7a1b64
+Revises: aba64d74ec58
+Create Date: 2025-10-01 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2d7a1b64'
+down_revision: Union[str, Sequence[str], None] = 'aba64d74ec58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # now() - стабильная функция, поэтому PostgreSQL 11+ добавляет
+    # колонки без перезаписи таблицы
+    op.add_column(
+        'images',
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=False)
+    )
+    op.add_column(
+        'images',
+        sa.Column('updated_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=False)
+    )
+
+    # Индексы строим без блокировки записи в таблицу
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_images_created_at_id', 'images', ['created_at', 'id'],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_images_status_created_at_id', 'images',
+            ['status', 'created_at', 'id'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_images_status_created_at_id', table_name='images',
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_images_created_at_id', table_name='images',
+            postgresql_concurrently=True
+        )
+    op.drop_column('images', 'updated_at')
+    op.drop_column('images', 'created_at')
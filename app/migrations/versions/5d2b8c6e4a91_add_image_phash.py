@@ -0,0 +1,29 @@
+"""Add perceptual hash column
+
+Revision ID: 5d2b8c6e4a91
+Revises: c4a7e93d5f10
+Create Date: 2025-10-04 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2b8c6e4a91'
+down_revision: Union[str, Sequence[str], None] = 'c4a7e93d5f10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('phash', sa.BigInteger(),
+                                      nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('images', 'phash')
@@ -0,0 +1,49 @@
+"""Add enqueued_at column for lost task recovery
+
+Revision ID: 7a3d9e2f1c58
+Revises: e6f1a2b3c4d5
+Create Date: 2025-10-08 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a3d9e2f1c58'
+down_revision: Union[str, Sequence[str], None] = 'e6f1a2b3c4d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('enqueued_at',
+                                      sa.DateTime(timezone=True),
+                                      nullable=True))
+    # Задачи для уже существующих NEW считаем отправленными, иначе
+    # reaper продублирует всю текущую очередь. Потерянные среди них
+    # reaper восстановит, когда очередь опустеет
+    op.execute(
+        "UPDATE images SET enqueued_at = updated_at WHERE status = 'NEW'"
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_images_unenqueued_updated_at', 'images', ['updated_at'],
+            postgresql_where=sa.text(
+                "status = 'NEW' AND enqueued_at IS NULL"
+            ),
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_images_unenqueued_updated_at', table_name='images',
+            postgresql_concurrently=True
+        )
+    op.drop_column('images', 'enqueued_at')
@@ -0,0 +1,36 @@
+"""Add status/updated_at index for stale job reaper
+
+Revision ID: 8b1e4f0c9d27
+Revises: 3f9c2d7a1b64
+Create Date: 2025-10-02 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1e4f0c9d27'
+down_revision: Union[str, Sequence[str], None] = '3f9c2d7a1b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_images_status_updated_at', 'images',
+            ['status', 'updated_at'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_images_status_updated_at', table_name='images',
+            postgresql_concurrently=True
+        )
@@ -0,0 +1,38 @@
+"""Add image header metadata columns
+
+Revision ID: c4a7e93d5f10
+Revises: 8b1e4f0c9d27
+Create Date: 2025-10-03 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a7e93d5f10'
+down_revision: Union[str, Sequence[str], None] = '8b1e4f0c9d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('format', sa.String(length=16),
+                                      nullable=True))
+    op.add_column('images', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('images', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('images', sa.Column('orientation', sa.SmallInteger(),
+                                      nullable=True))
+    op.add_column('images', sa.Column('frames', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('images', 'frames')
+    op.drop_column('images', 'orientation')
+    op.drop_column('images', 'height')
+    op.drop_column('images', 'width')
+    op.drop_column('images', 'format')
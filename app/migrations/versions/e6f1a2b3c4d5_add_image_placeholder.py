@@ -0,0 +1,29 @@
+"""Add inline placeholder column
+
+Revision ID: e6f1a2b3c4d5
+Revises: 5d2b8c6e4a91
+Create Date: 2025-10-05 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6f1a2b3c4d5'
+down_revision: Union[str, Sequence[str], None] = '5d2b8c6e4a91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('placeholder', sa.Text(),
+                                      nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('images', 'placeholder')
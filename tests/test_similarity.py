@@ -0,0 +1,195 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+import pytest
+
+from app.backend.images.similarity import MAX_DISTANCE, PerceptualHashIndex
+
+DISTANCES = [0, 1, 3, 4, 8, 11, MAX_DISTANCE]
+POSITION = (datetime(2025, 1, 1, tzinfo=timezone.utc), UUID(int=1))
+
+
+def random_id(rng: random.Random, zero_tail: int = 0) -> UUID:
+    """UUID, байты которого заканчиваются zero_tail нулями."""
+    data = rng.randbytes(16 - zero_tail) + bytes(zero_tail)
+    return UUID(bytes=data)
+
+
+def flip_bits(rng: random.Random, value: int, count: int) -> int:
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def clustered_hashes(
+        rng: random.Random,
+        count: int
+) -> List[int]:
+    """Хеши группами вокруг общих центров, чтобы были близкие пары."""
+    centers = [rng.getrandbits(64) for _ in range(count // 10)]
+    return [
+        flip_bits(rng, rng.choice(centers), rng.randint(0, MAX_DISTANCE + 2))
+        for _ in range(count)
+    ]
+
+
+def brute_force(
+        expected: Dict[UUID, int],
+        value: int,
+        max_distance: int
+) -> List[Tuple[UUID, int]]:
+    found = []
+    for image_id, other in expected.items():
+        distance = bin(value ^ other).count("1")
+        if distance <= max_distance:
+            found.append((image_id, distance))
+    return sorted(found)
+
+
+def build_index(
+        snapshot_path: Optional[str] = None
+) -> Tuple[PerceptualHashIndex, Dict[UUID, int]]:
+    """Индекс с хешами в основной части и в pending.
+
+    Часть хешей заменена или удалена после построения основной части,
+    часть ID заканчивается нулевыми байтами.
+    """
+    rng = random.Random(1234)
+    index = PerceptualHashIndex(snapshot_path=snapshot_path)
+    expected: Dict[UUID, int] = {}
+
+    hashes = clustered_hashes(rng, 3000)
+    for position, value in enumerate(hashes[:2000]):
+        image_id = random_id(rng, zero_tail=position % 4)
+        index.add(image_id, value)
+        expected[image_id] = value
+    index.position = POSITION
+    asyncio.run(index._rebuild())
+    assert not index.pending
+
+    for position, value in enumerate(hashes[2000:]):
+        image_id = random_id(rng, zero_tail=position % 3)
+        index.add(image_id, value)
+        expected[image_id] = value
+
+    ids = list(expected)
+    # Замена хеша в основной части и в pending
+    for image_id in ids[:100] + ids[2000:2050]:
+        value = flip_bits(rng, expected[image_id], rng.randint(1, 6))
+        index.add(image_id, value)
+        expected[image_id] = value
+    # Удаление из основной части и из pending
+    for image_id in ids[100:200] + ids[2050:2100]:
+        index.remove(image_id)
+        del expected[image_id]
+
+    return index, expected
+
+
+def queries(expected: Dict[UUID, int]) -> List[int]:
+    rng = random.Random(99)
+    values = list(expected.values())
+    return (
+        rng.sample(values, 30)
+        + [flip_bits(rng, value, 5) for value in rng.sample(values, 20)]
+        + [rng.getrandbits(64) for _ in range(10)]
+    )
+
+
+def check_search(
+        index: PerceptualHashIndex,
+        expected: Dict[UUID, int],
+        max_distance: int
+) -> None:
+    for value in queries(expected):
+        found = index.search(value, max_distance)
+        distances = [distance for _, distance in found]
+        assert distances == sorted(distances)
+        assert sorted(found) == brute_force(expected, value, max_distance)
+
+
+@pytest.fixture(scope="module")
+def populated() -> Tuple[PerceptualHashIndex, Dict[UUID, int]]:
+    return build_index()
+
+
+@pytest.mark.parametrize("max_distance", DISTANCES)
+def test_search_matches_brute_force(
+        populated: Tuple[PerceptualHashIndex, Dict[UUID, int]],
+        max_distance: int
+) -> None:
+    index, expected = populated
+    assert index.pending and len(index.segment)
+    assert len(index) == len(expected)
+    check_search(index, expected, max_distance)
+
+
+def test_get(
+        populated: Tuple[PerceptualHashIndex, Dict[UUID, int]]
+) -> None:
+    index, expected = populated
+    for image_id, value in expected.items():
+        assert index.get(image_id) == value
+    assert index.get(UUID(int=0)) is None
+
+
+@pytest.mark.parametrize("max_distance", [0, MAX_DISTANCE])
+def test_search_after_rebuild(max_distance: int) -> None:
+    index, expected = build_index()
+    asyncio.run(index._rebuild())
+    assert not index.pending
+    check_search(index, expected, max_distance)
+
+
+@pytest.mark.parametrize(
+    "zero_tail", [1, 2, 8, 15], ids=["1", "2", "8", "15"]
+)
+def test_ids_with_trailing_zero_bytes(zero_tail: int) -> None:
+    image_id = random_id(random.Random(zero_tail), zero_tail)
+    index = PerceptualHashIndex(snapshot_path=None)
+    index.add(image_id, 0xF0F0)
+    index.add(UUID(int=2 ** 128 - 1), 0xF0F0)
+    index.position = POSITION
+    asyncio.run(index._rebuild())
+
+    assert index.get(image_id) == 0xF0F0
+    assert (image_id, 1) in index.search(0xF0F1, 1)
+    index.remove(image_id)
+    assert [found for found, _ in index.search(0xF0F0, 0)] == [
+        UUID(int=2 ** 128 - 1)
+    ]
+
+
+@pytest.mark.parametrize("max_distance", [0, MAX_DISTANCE])
+def test_empty_index(max_distance: int) -> None:
+    index = PerceptualHashIndex(snapshot_path=None)
+    assert len(index) == 0
+    assert index.search(0, max_distance) == []
+    asyncio.run(index._rebuild())
+    assert index.search(2 ** 64 - 1, max_distance) == []
+
+
+def test_snapshot_round_trip(tmp_path) -> None:
+    path = str(tmp_path / "phash_index.npz")
+    index, expected = build_index(snapshot_path=path)
+    # Остановка переносит pending в основную часть и сохраняет снимок
+    asyncio.run(index.stop())
+
+    restored = PerceptualHashIndex(snapshot_path=path)
+    assert asyncio.run(restored.load_snapshot())
+    assert restored.position == POSITION
+    assert len(restored) == len(expected)
+    for max_distance in (0, 8, MAX_DISTANCE):
+        check_search(restored, expected, max_distance)
+
+
+def test_missing_or_broken_snapshot(tmp_path) -> None:
+    path = tmp_path / "phash_index.npz"
+    index = PerceptualHashIndex(snapshot_path=str(path))
+    assert not asyncio.run(index.load_snapshot())
+    path.write_bytes(b"not a snapshot")
+    assert not asyncio.run(index.load_snapshot())
+    assert len(index) == 0
@@ -0,0 +1,294 @@
+import struct
+
+import pytest
+
+from app.backend.images.sniffing import (
+    MAX_HEADER_BYTES, MAX_IMAGE_SIDE, ImageHeader, ImageSniffer,
+    ImageTooLargeError, UnsupportedImageError
+)
+
+
+def tiff(orientation: int, order: str = "<") -> bytes:
+    """TIFF-структура EXIF с одним тегом Orientation."""
+    mark = b"II" if order == "<" else b"MM"
+    return (
+        mark + struct.pack(order + "HI", 42, 8)
+        + struct.pack(order + "H", 1)
+        + struct.pack(order + "HHIHH", 0x0112, 3, 1, orientation, 0)
+        + struct.pack(order + "I", 0)
+    )
+
+
+def jpeg(
+        width: int,
+        height: int,
+        orientation: int = 0,
+        order: str = "<",
+        sof: int = 0xC0
+) -> bytes:
+    data = b"\xff\xd8"
+    if orientation:
+        payload = b"Exif\0\0" + tiff(orientation, order)
+        data += b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+    # Таблица квантования перед заголовком кадра
+    data += b"\xff\xdb" + struct.pack(">H", 67) + bytes(65)
+    data += bytes([0xFF, sof]) + struct.pack(
+        ">HBHHB", 11, 8, height, width, 1
+    ) + bytes(3)
+    return data + b"\xff\xda" + struct.pack(">H", 8) + bytes(6) + b"\xff\xd9"
+
+
+def png_chunk(chunk_type: bytes, payload: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(payload)) + chunk_type + payload + bytes(4)
+    )
+
+
+def png(width: int, height: int, *chunks: bytes) -> bytes:
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height,
+                                         8, 2, 0, 0, 0))
+        + b"".join(chunks)
+        + png_chunk(b"IDAT", bytes(16))
+        + png_chunk(b"IEND", b"")
+    )
+
+
+def gif(width: int, height: int) -> bytes:
+    return b"GIF89a" + struct.pack("<HH", width, height) + bytes(10)
+
+
+def webp_chunk(chunk_type: bytes, payload: bytes) -> bytes:
+    padding = b"\0" if len(payload) & 1 else b""
+    return (
+        chunk_type + struct.pack("<I", len(payload)) + payload + padding
+    )
+
+
+def riff(*chunks: bytes) -> bytes:
+    body = b"WEBP" + b"".join(chunks)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def vp8(width: int, height: int) -> bytes:
+    return webp_chunk(
+        b"VP8 ",
+        bytes(3) + b"\x9d\x01\x2a" + struct.pack("<HH", width, height)
+        + bytes(10)
+    )
+
+
+def vp8l(width: int, height: int) -> bytes:
+    bits = (width - 1) | (height - 1) << 14
+    return webp_chunk(b"VP8L", b"\x2f" + struct.pack("<I", bits) + bytes(5))
+
+
+def vp8x(width: int, height: int, flags: int = 0) -> bytes:
+    return webp_chunk(
+        b"VP8X",
+        bytes([flags, 0, 0, 0])
+        + (width - 1).to_bytes(3, "little")
+        + (height - 1).to_bytes(3, "little")
+    )
+
+
+def bmp(width: int, height: int) -> bytes:
+    return b"BM" + bytes(16) + struct.pack("<ii", width, height) + bytes(28)
+
+
+def sniff(data: bytes, chunk_size: int = 64 * 1024) -> ImageHeader:
+    """Разобрать заголовок, подавая данные частями, как при загрузке."""
+    sniffer = ImageSniffer()
+    for start in range(0, len(data), chunk_size):
+        header = sniffer.feed(data[start:start + chunk_size])
+        if header is not None:
+            return header
+    return sniffer.close()
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        (jpeg(640, 480), ImageHeader("jpeg", 640, 480)),
+        (jpeg(800, 600, sof=0xC2), ImageHeader("jpeg", 800, 600)),
+        (png(1, 1), ImageHeader("png", 1, 1)),
+        (
+            png(320, 200, png_chunk(b"acTL", struct.pack(">II", 12, 0))),
+            ImageHeader("png", 320, 200, frames=12)
+        ),
+        (gif(16, 9), ImageHeader("gif", 16, 9, frames=None)),
+        (riff(vp8(1024, 768)), ImageHeader("webp", 1024, 768)),
+        (riff(vp8l(300, 7)), ImageHeader("webp", 300, 7)),
+        (
+            riff(vp8x(5000, 4000), vp8(5000, 4000)),
+            ImageHeader("webp", 5000, 4000)
+        ),
+        (
+            riff(vp8x(64, 64, flags=0x02)),
+            ImageHeader("webp", 64, 64, frames=None)
+        ),
+        (bmp(100, 50), ImageHeader("bmp", 100, 50)),
+        # Отрицательная высота - строки сверху вниз
+        (bmp(100, -50), ImageHeader("bmp", 100, 50)),
+    ],
+    ids=[
+        "jpeg", "jpeg-progressive", "png", "apng", "gif", "webp-vp8",
+        "webp-vp8l", "webp-vp8x", "webp-animated", "bmp", "bmp-top-down",
+    ]
+)
+def test_formats(data: bytes, expected: ImageHeader) -> None:
+    assert sniff(data) == expected
+
+
+@pytest.mark.parametrize(
+    "data, orientation",
+    [
+        (jpeg(10, 20, orientation=6), 6),
+        (jpeg(10, 20, orientation=8, order=">"), 8),
+        # Значение вне диапазона 1-8 игнорируется
+        (jpeg(10, 20, orientation=9), 1),
+        (png(10, 20, png_chunk(b"eXIf", tiff(3))), 3),
+        (
+            riff(vp8x(10, 20, flags=0x08), vp8(10, 20),
+                 webp_chunk(b"EXIF", tiff(5, ">"))),
+            5
+        ),
+        # EXIF с префиксом APP1 из JPEG
+        (
+            riff(vp8x(10, 20, flags=0x08), vp8(10, 20),
+                 webp_chunk(b"EXIF", b"Exif\0\0" + tiff(7))),
+            7
+        ),
+        # Флаг EXIF есть, а чанка нет
+        (riff(vp8x(10, 20, flags=0x08), vp8(10, 20)), 1),
+    ],
+    ids=[
+        "jpeg-le", "jpeg-be", "jpeg-invalid", "png", "webp",
+        "webp-app1-prefix", "webp-missing-chunk",
+    ]
+)
+def test_exif_orientation(data: bytes, orientation: int) -> None:
+    assert sniff(data).orientation == orientation
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        jpeg(640, 480, orientation=6),
+        png(640, 480, png_chunk(b"acTL", struct.pack(">II", 2, 0))),
+        riff(vp8x(64, 64, flags=0x08), vp8(64, 64),
+             webp_chunk(b"EXIF", tiff(6))),
+        gif(16, 9),
+        bmp(100, 50),
+    ],
+    ids=["jpeg", "png", "webp", "gif", "bmp"]
+)
+def test_header_split_across_chunks(data: bytes) -> None:
+    assert sniff(data, chunk_size=1) == sniff(data)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        jpeg(640, 480)[:30],
+        png(640, 480)[:20],
+        # IHDR есть, но файл обрывается до IDAT
+        png(640, 480, png_chunk(b"tEXt", bytes(100)))[:60],
+        gif(16, 9)[:8],
+        riff(vp8(64, 64))[:25],
+        riff(vp8x(64, 64, flags=0x08), vp8(64, 64),
+             webp_chunk(b"EXIF", tiff(6)))[:40],
+        bmp(100, 50)[:20],
+        b"\xff\xd8\xff",
+    ],
+    ids=[
+        "jpeg", "png", "png-chunks", "gif", "webp", "webp-exif", "bmp",
+        "short",
+    ]
+)
+def test_truncated(data: bytes) -> None:
+    sniffer = ImageSniffer()
+    assert sniffer.feed(data) is None
+    with pytest.raises(UnsupportedImageError, match="обрывается"):
+        sniffer.close()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        jpeg(MAX_IMAGE_SIDE + 1, 10),
+        jpeg(10000, 10000),
+        png(60000, 60000),
+        gif(MAX_IMAGE_SIDE + 1, 1),
+        riff(vp8l(16384, 16384)),
+        riff(vp8x(MAX_IMAGE_SIDE + 1, 1)),
+        bmp(10, -(MAX_IMAGE_SIDE + 1)),
+    ],
+    ids=[
+        "jpeg-side", "jpeg-pixels", "png", "gif", "webp-vp8l",
+        "webp-vp8x", "bmp",
+    ]
+)
+def test_oversized(data: bytes) -> None:
+    with pytest.raises(ImageTooLargeError):
+        sniff(data)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"definitely not an image",
+        b"\x89PNG\r\n\x1a\n" + png_chunk(b"tEXt", bytes(16)),
+        riff(webp_chunk(b"ALPH", bytes(20))),
+        jpeg(0, 480),
+        b"\xff\xd8\xff\xd9" + bytes(16),
+    ],
+    ids=["text", "png-no-ihdr", "webp-unknown", "zero-size", "jpeg-no-sof"]
+)
+def test_unsupported(data: bytes) -> None:
+    with pytest.raises(UnsupportedImageError):
+        sniff(data)
+
+
+def test_oversized_png_rejected_before_header_budget() -> None:
+    # Размеры проверяются сразу после IHDR, не дожидаясь IDAT
+    data = png(60000, 60000, png_chunk(b"tEXt", bytes(1100 * 1024)))
+    sniffer = ImageSniffer()
+    with pytest.raises(ImageTooLargeError):
+        sniffer.feed(data[:64])
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        # Большой XMP перед IDAT: acTL и eXIf за ним не ищутся
+        (
+            png(640, 480,
+                png_chunk(b"iTXt", bytes(MAX_HEADER_BYTES + 200_000)),
+                png_chunk(b"acTL", struct.pack(">II", 5, 0))),
+            ImageHeader("png", 640, 480)
+        ),
+        # EXIF в конце большого WebP за пределами бюджета
+        (
+            riff(vp8x(640, 480, flags=0x08),
+                 webp_chunk(b"VP8 ", bytes(MAX_HEADER_BYTES + 200_000)),
+                 webp_chunk(b"EXIF", tiff(6))),
+            ImageHeader("webp", 640, 480)
+        ),
+    ],
+    ids=["png-xmp", "webp-exif"]
+)
+def test_optional_fields_beyond_header_budget(
+        data: bytes,
+        expected: ImageHeader
+) -> None:
+    assert sniff(data) == expected
+
+
+def test_jpeg_without_sof_within_budget() -> None:
+    # Размеры JPEG не найдены в пределах бюджета - файл отклоняется
+    padding = b"\xff\xe2" + struct.pack(">H", 0xFFFF) + bytes(0xFFFD)
+    data = b"\xff\xd8" + padding * 20 + jpeg(10, 10)[2:]
+    with pytest.raises(UnsupportedImageError, match="не найден"):
+        sniff(data)